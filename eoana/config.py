@@ -9,8 +9,9 @@ Created on 2020-12-11 15:57
 import os
 from pathlib import Path
 import rasterio as rio
+from pyresample import load_area
 from eoana.readers.yml import yaml_reader
-from eoana.utils import generate_filepaths, recursive_dict_update
+from eoana.utils import generate_filepaths, get_polygon, recursive_dict_update
 
 
 class SettingsBase:
@@ -144,16 +145,31 @@ class Settings(SettingsBase):
 
         return os.path.join(target_path, file_name)
 
+    def get_area_definition(self, area_name, area_file='areas_baws.yaml'):
+        """Return pyresample AreaDefinition for the given area name.
+
+        :param area_name: str, eg. 'baws300_sweref99tm'
+        :param area_file: str, name of file in etc/areas
+        :return: pyresample.geometry.AreaDefinition
+        """
+        return load_area(os.path.join(self.etc_path, 'areas', area_file), area_name)
+
+    def get_zone_grid(self, file_name, band=1):
+        """Return zone grid (eg. basin ids) from etc/basin_grid.
+
+        :param file_name: str, eg. 'SVAR_2016_3b_coastal_zone.tiff' or 'helcom_ospar.tiff'
+        :param band: int
+        :return: 2-D array
+        """
+        with rio.open(os.path.join(self.etc_path, 'basin_grid', file_name)) as rst:
+            return rst.read(band)
+
     def get_basin_grid(self):
         """Doc."""
-        rst = rio.open(os.path.join(
-            self.etc_path,
-            'basin_grid',
+        return self.get_zone_grid(
             'SVAR_2016_3b_Hanö.tiff',
             # 'SVAR_2016_3b.tiff',
-        ))
-        array = rst.read()
-        return array[0]
+        )
 
     def get_basin_grid_corners(self):
         """Doc."""
@@ -165,6 +181,13 @@ class Settings(SettingsBase):
         ))
         return rst.bounds
 
+    def get_basin_grid_polygon(self):
+        """Return lon/lat polygon (EPSG:4326) of the basin grid corners."""
+        bbox = self.get_basin_grid_corners()
+        return get_polygon(llc=(bbox.left, bbox.bottom),
+                           urc=(bbox.right, bbox.top),
+                           in_proj='EPSG:3006')
+
 
 if __name__ == '__main__':
     settings = Settings()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-15 13:12
+
+@author: johannes
+"""
+import numpy as np
+import rasterio as rio
+import shapely
+from shapely.strtree import STRtree
+from eoana.handlers.grid_locator import GridLocator
+from eoana.handlers.matchup import get_window_values
+from eoana.utils import get_transformer
+
+
+class BasinTagger:
+    """Tag positions with the name of the polygon (basin) they are within.
+
+    Polygons are indexed in an STRtree and all positions are queried in one
+    call. Optionally a rasterized version of the polygons (eg.
+    etc/basin_grid/helcom_ospar.tiff) is used as a direct lookup, only
+    positions close to a border (3x3 neighbourhood not within one zone)
+    or outside the raster fall back to the polygons.
+
+    Usage:
+        tagger = BasinTagger.from_file('helcom_ospar.shp', name_column='level_3')
+        basins = tagger.tag(lat_array, lon_array)
+    """
+
+    def __init__(self, geometries, names, zone_raster=None, zone_names=None):
+        """Build the spatial index.
+
+        :param geometries: array of shapely polygons in WGS84 (lon, lat)
+        :param names: array of names, one per polygon
+        :param zone_raster: str, path to rasterized polygons (zone ids > 0)
+        :param zone_names: dict, {zone id: name}. Derived from the polygons
+                           if not given.
+        """
+        self.geometries = np.asarray(geometries)
+        self.names = np.asarray(names, dtype=object)
+        self.tree = STRtree(self.geometries)
+        self.zone_array = None
+        self.zone_names = None
+        self.locator = None
+        if zone_raster:
+            self.set_zone_raster(zone_raster, zone_names=zone_names)
+
+    @classmethod
+    def from_file(cls, shp_path, name_column='level_3', **kwargs):
+        """Return tagger for a shapefile (or any file read by geopandas)."""
+        import geopandas as gp
+        shapes = gp.read_file(shp_path).to_crs('EPSG:4326')
+        return cls(shapes.geometry.values, shapes[name_column].values, **kwargs)
+
+    def set_zone_raster(self, path, zone_names=None):
+        """Use a rasterized version of the polygons for the lookup.
+
+        :param path: str, raster with zone ids (0: outside any zone)
+        :param zone_names: dict, {zone id: name}
+        """
+        with rio.open(path) as rst:
+            self.zone_array = rst.read(1, out_dtype=np.float32)
+            crs = rst.crs.to_wkt()
+            transform = rst.transform
+        self.locator = GridLocator.from_raster(path)
+        if zone_names is None:
+            zone_names = self._get_zone_names(crs, transform)
+        self.zone_names = zone_names
+
+    def _get_zone_names(self, crs, transform):
+        """Return {zone id: name} from one interior pixel of every zone."""
+        zones = self.zone_array
+        interior = np.zeros(zones.shape, dtype=bool)
+        interior[1:-1, 1:-1] = (zones[1:-1, 1:-1] > 0) & (
+            (zones[1:-1, 1:-1] == zones[:-2, 1:-1]) &
+            (zones[1:-1, 1:-1] == zones[2:, 1:-1]) &
+            (zones[1:-1, 1:-1] == zones[1:-1, :-2]) &
+            (zones[1:-1, 1:-1] == zones[1:-1, 2:])
+        )
+        rows, cols = np.nonzero(interior)
+        zone_ids, first = np.unique(zones[rows, cols], return_index=True)
+        x, y = rio.transform.xy(transform, rows[first], cols[first])
+        lons, lats = get_transformer(crs, 'EPSG:4326').transform(
+            np.asarray(x), np.asarray(y))
+        names = self._tag_polygons(np.asarray(lats), np.asarray(lons))
+        return {zone_id.item(): name for zone_id, name in zip(zone_ids, names)
+                if name}
+
+    def _tag_polygons(self, lats, lons):
+        """Return names of the polygons containing the positions ('' if none)."""
+        result = np.full(lats.size, '', dtype=object)
+        if not lats.size:
+            return result
+        points = shapely.points(lons, lats)
+        point_idx, tree_idx = self.tree.query(points, predicate='within')
+        # Overlapping polygons: the first polygon in order is used.
+        order = np.lexsort((tree_idx, point_idx))
+        point_idx, tree_idx = point_idx[order], tree_idx[order]
+        first = np.r_[True, point_idx[1:] != point_idx[:-1]]
+        result[point_idx[first]] = self.names[tree_idx[first]]
+        return result
+
+    def _tag_raster(self, lats, lons):
+        """Return names from the zone raster and a mask of tagged positions.
+
+        Positions near borders or outside the raster are not tagged.
+        """
+        rows, cols = self.locator.get_index(lats, lons)
+        window = get_window_values(self.zone_array, rows, cols, size=3)
+        centre = window[:, 4]
+        homogeneous = (window == centre[:, np.newaxis]).all(axis=1) & (centre > 0)
+        result = np.full(lats.size, '', dtype=object)
+        tagged = np.zeros(lats.size, dtype=bool)
+        for zone_id in np.unique(centre[homogeneous]):
+            name = self.zone_names.get(int(zone_id))
+            if name:
+                selection = homogeneous & (centre == zone_id)
+                result[selection] = name
+                tagged |= selection
+        return result, tagged
+
+    def tag(self, lat, lon):
+        """Return basin names for the given positions.
+
+        :param lat: array of latitudes (WGS84)
+        :param lon: array of longitudes (WGS84)
+        :return: object array of names, '' outside all polygons
+        """
+        lats = np.atleast_1d(np.asarray(lat, dtype=np.float64)).ravel()
+        lons = np.atleast_1d(np.asarray(lon, dtype=np.float64)).ravel()
+        positions, inverse = np.unique(np.column_stack((lats, lons)), axis=0,
+                                       return_inverse=True)
+        lats, lons = positions[:, 0], positions[:, 1]
+        if self.zone_array is not None:
+            result, tagged = self._tag_raster(lats, lons)
+            fallback = ~tagged
+            result[fallback] = self._tag_polygons(lats[fallback], lons[fallback])
+        else:
+            result = self._tag_polygons(lats, lons)
+        return result[inverse.ravel()]
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-07 08:52
+
+@author: johannes
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from eoana.readers.geotiff import read_band, get_legacy_nan_value
+
+SEASONS = {
+    'spring': ('03', '04', '05'),
+    'summer': ('06', '07', '08'),
+    'autumn': ('09', '10', '11'),
+}
+
+
+class CompositeAccumulator:
+    """Streaming composite of rasters on a common grid.
+
+    Rasters are added one at a time into float32 sum and sum of squares
+    planes and a uint16 count plane, memory is constant regardless of the
+    number of rasters. Mean, std and count rasters are derived on request.
+
+    With a MaskedGrid (eoana.handlers.masked_grid) the planes only hold the
+    valid (sea) pixels as vectors; dense rasters are compressed when added
+    and mean / std are vectors, see MaskedGrid.expand.
+
+    Usage:
+        accumulator = CompositeAccumulator.from_raster(files[0])
+        for fid in files:
+            accumulator.add_file(fid)
+        mean_array = accumulator.mean()
+    """
+
+    def __init__(self, shape, nan_value=None, grid=None):
+        """Initiate the planes.
+
+        :param shape: tuple, (rows, cols) of the grid
+        :param nan_value: value treated as missing besides nan, eg. 0
+        :param grid: MaskedGrid, store only its valid pixels (shape is ignored)
+        """
+        self.grid = grid
+        self.shape = (grid.size,) if grid is not None else tuple(shape)
+        self.nan_value = nan_value
+        self.sum = np.zeros(self.shape, dtype=np.float32)
+        self.sum_sq = np.zeros(self.shape, dtype=np.float32)
+        self.count = np.zeros(self.shape, dtype=np.uint16)
+        self.n_rasters = 0
+
+    @classmethod
+    def from_raster(cls, path, **kwargs):
+        """Return an empty accumulator on the grid of the given raster."""
+        with rio.open(path) as rst:
+            return cls(rst.shape, **kwargs)
+
+    def _get_slices(self, window):
+        if window is None:
+            return Ellipsis
+        if isinstance(window, rio.windows.Window):
+            return window.toslices()
+        return window
+
+    def add(self, array, window=None):
+        """Add a raster (or a window of it) to the composite.
+
+        :param array: 2-D array, missing values as nan or nan_value
+                      (or vector of the valid pixels of the masked grid)
+        :param window: rasterio Window or tuple of slices, part of the grid
+                       that array covers. None for the full grid.
+        """
+        slices = self._get_slices(window)
+        array = np.asarray(array, dtype=np.float32)
+        if self.grid is not None and array.ndim == 2:
+            if window is not None:
+                raise ValueError('Windows are not supported with a masked grid')
+            array = self.grid.compress(array)
+        valid = np.isfinite(array)
+        if self.nan_value is not None:
+            valid &= array != self.nan_value
+        np.add(self.sum[slices], array, out=self.sum[slices], where=valid)
+        np.add(self.sum_sq[slices], np.square(array), out=self.sum_sq[slices],
+               where=valid)
+        np.add(self.count[slices], 1, out=self.count[slices], where=valid,
+               casting='unsafe')
+        if window is None:
+            self.n_rasters += 1
+
+    def add_file(self, path, band=1, windowed=False):
+        """Add a raster file to the composite.
+
+        Packed (scale / offset) rasters are decoded and nodata is missing,
+        0 is missing in unpacked float rasters, see get_legacy_nan_value.
+
+        :param path: str, raster file on the same grid
+        :param band: int
+        :param windowed: bool, read and add the file block by block
+                         (not with a masked grid)
+        """
+        with rio.open(path) as rst:
+            nan_value = get_legacy_nan_value(rst, band)
+            if windowed and self.grid is None:
+                for _, window in rst.block_windows(band):
+                    self.add(read_band(rst, band=band, window=window,
+                                       nan_value=nan_value),
+                             window=window)
+                self.n_rasters += 1
+            else:
+                self.add(read_band(rst, band=band, nan_value=nan_value))
+
+    def add_files(self, paths, **kwargs):
+        """Add several raster files, see add_file."""
+        for path in paths:
+            self.add_file(path, **kwargs)
+        return self
+
+    def merge(self, other):
+        """Add the planes of another accumulator on the same grid."""
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.count += other.count
+        self.n_rasters += other.n_rasters
+        return self
+
+    def subtract(self, other):
+        """Remove the planes of another accumulator (previously merged)."""
+        self.sum -= other.sum
+        self.sum_sq -= other.sum_sq
+        self.count -= other.count
+        self.n_rasters -= other.n_rasters
+        return self
+
+    def save(self, path):
+        """Save the planes to a compressed .npz file."""
+        np.savez_compressed(path, sum=self.sum, sum_sq=self.sum_sq,
+                            count=self.count, n_rasters=self.n_rasters,
+                            nan_value=np.nan if self.nan_value is None
+                            else self.nan_value)
+
+    @classmethod
+    def load(cls, path):
+        """Return accumulator saved with save."""
+        with np.load(path) as planes:
+            nan_value = float(planes['nan_value'])
+            accumulator = cls(planes['count'].shape,
+                              nan_value=None if np.isnan(nan_value) else nan_value)
+            accumulator.sum[:] = planes['sum']
+            accumulator.sum_sq[:] = planes['sum_sq']
+            accumulator.count[:] = planes['count']
+            accumulator.n_rasters = int(planes['n_rasters'])
+        return accumulator
+
+    def mean(self):
+        """Return mean raster (float32), nan where count is 0."""
+        mean = np.full(self.shape, np.nan, dtype=np.float32)
+        np.divide(self.sum, self.count, out=mean, where=self.count > 0)
+        return mean
+
+    def std(self):
+        """Return (population) standard deviation raster, nan where count is 0."""
+        mean = self.mean()
+        var = np.full(self.shape, np.nan, dtype=np.float32)
+        np.divide(self.sum_sq, self.count, out=var, where=self.count > 0)
+        var -= np.square(mean)
+        np.maximum(var, 0., out=var)
+        return np.sqrt(var, out=var)
+
+
+def get_parent_periods(date):
+    """Return the periods a date belongs to.
+
+    :param date: str / datetime, eg. '20210715'
+    :return: list, eg. ['202107', '2021_summer', '2021']
+    """
+    date = pd.Timestamp(date)
+    year, month = date.strftime('%Y'), date.strftime('%m')
+    periods = [year + month]
+    periods.extend(f'{year}_{season}' for season, months in SEASONS.items()
+                   if month in months)
+    periods.append(year)
+    return periods
+
+
+class CompositeStore:
+    """Hierarchical store of composite partial sums.
+
+    Sum, sum of squares and count planes (CompositeAccumulator) are stored
+    per day ('YYYYMMDD') and derived for month ('YYYYMM'), season
+    ('YYYY_spring', 'YYYY_summer', 'YYYY_autumn', see SEASONS) and year
+    ('YYYY') by adding partial sums. Adding (or replacing) a day only
+    updates the periods that day belongs to, and period means are weighted
+    by every valid observation rather than by day.
+
+    The files of one add_day (day and parents) are first written to a
+    pending directory, listed in a journal and then moved into place. An
+    interrupted update is completed when the store is opened again, so a
+    day is never added to its parents twice.
+
+    Usage:
+        store = CompositeStore('/composites')
+        store.add_day('20210715', daily_accumulator)
+        mean_array = store.get('2021_summer').mean()
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pending_directory = os.path.join(directory, '.pending')
+        os.makedirs(self.pending_directory, exist_ok=True)
+        self._complete_pending()
+
+    def _get_path(self, period):
+        return os.path.join(self.directory, f'{period}.npz')
+
+    def _get_journal_path(self):
+        return os.path.join(self.pending_directory, 'journal.json')
+
+    def _complete_pending(self):
+        """Move the files of a journaled (interrupted) update into place.
+
+        Without a journal the update never got to the moves, pending files
+        are left overs and removed.
+        """
+        journal_path = self._get_journal_path()
+        if os.path.isfile(journal_path):
+            with open(journal_path, 'r') as fd:
+                moves = json.load(fd)
+            for pending_path, path in moves.items():
+                if os.path.isfile(pending_path):
+                    os.replace(pending_path, path)
+            os.remove(journal_path)
+        for file_name in os.listdir(self.pending_directory):
+            os.remove(os.path.join(self.pending_directory, file_name))
+
+    def _save_all(self, accumulators):
+        """Save {period: accumulator} as one update, see _complete_pending."""
+        moves = {}
+        for period, accumulator in accumulators.items():
+            pending_path = os.path.join(self.pending_directory, f'{period}.npz')
+            accumulator.save(pending_path)
+            moves[pending_path] = self._get_path(period)
+        journal_path = self._get_journal_path()
+        with open(journal_path + '.tmp', 'w') as fd:
+            json.dump(moves, fd)
+        os.replace(journal_path + '.tmp', journal_path)
+        self._complete_pending()
+
+    def has_period(self, period):
+        """Return True if the period is stored."""
+        return os.path.isfile(self._get_path(period))
+
+    def has_day(self, date):
+        """Return True if the date (str / datetime) is stored."""
+        return self.has_period(pd.Timestamp(date).strftime('%Y%m%d'))
+
+    def get(self, period):
+        """Return CompositeAccumulator of a period, None if not stored."""
+        if not self.has_period(period):
+            return None
+        return CompositeAccumulator.load(self._get_path(period))
+
+    def get_periods(self):
+        """Return names of all stored periods."""
+        return sorted(f[:-4] for f in os.listdir(self.directory)
+                      if f.endswith('.npz'))
+
+    def add_day(self, date, accumulator):
+        """Store the composite of one day and update its parent periods.
+
+        An already stored day is replaced, its old partial sums are
+        subtracted from the parent periods.
+
+        :param date: str / datetime
+        :param accumulator: CompositeAccumulator of all passages of the day
+        """
+        day = pd.Timestamp(date).strftime('%Y%m%d')
+        previous = self.get(day)
+        updated = {}
+        for period in get_parent_periods(day):
+            parent = self.get(period) or CompositeAccumulator(
+                accumulator.shape, nan_value=accumulator.nan_value)
+            if previous is not None:
+                parent.subtract(previous)
+            updated[period] = parent.merge(accumulator)
+        updated[day] = accumulator
+        self._save_all(updated)
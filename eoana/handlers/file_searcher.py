@@ -7,7 +7,15 @@ Created on 2022-02-10 19:38
 @author: johannes
 """
 import os
+import re
+import sqlite3
+from pathlib import Path
+import numpy as np
 import pandas as pd
+import xarray as xr
+from shapely import wkt
+from shapely.geometry import Polygon
+from eoana.utils import get_area_polygon
 
 OLCI_FILES = [
     'chl_nn.nc',
@@ -26,28 +34,345 @@ OLCI_FILES = [
     # 'instrument_data.nc', 'iwv.nc', 'par.nc', 'time_coordinates.nc',
 ]
 
+MANIFEST_FILE = 'xfdumanifest.xml'
+COORDINATES_FILE = 'geo_coordinates.nc'
 
-def get_file_list(base_folder, directory):
-    """Doc."""
+CATALOG_COLUMNS = [
+    'base_dir', 'directories', 'path', 'satellite', 'start_time', 'stop_time',
+    'orbit', 'frame', 'baseline', 'footprint',
+    'lat_min', 'lat_max', 'lon_min', 'lon_max', 'mtime',
+]
+
+
+def get_granule_folder(base_folder, directory):
+    """Return the folder holding the netcdf files of the granule."""
     # Special structure.. :(
     folder = os.path.join(base_folder, directory, directory)
     if os.path.exists(folder):
-        return [os.path.join(folder, f) for f in OLCI_FILES]
+        return folder
     else:
-        return [os.path.join(base_folder, directory, f) for f in OLCI_FILES]
+        return os.path.join(base_folder, directory)
+
+
+def get_file_list(base_folder, directory):
+    """Doc."""
+    folder = get_granule_folder(base_folder, directory)
+    return [os.path.join(folder, f) for f in OLCI_FILES]
+
+
+def parse_sen3_name(directory):
+    """Return attributes given by the name of a .SEN3 granule.
+
+    Eg. S3A_OL_2_WFR____20200720T081412_20200720T081712_20200721T170052_0179_060_349_1980_MAR_O_NT_002.SEN3
+    """
+    list_of_attributes = directory.split('.')[0].split('_')
+    return {
+        'satellite': list_of_attributes[0],
+        'start_time': list_of_attributes[7],
+        'stop_time': list_of_attributes[8],
+        'orbit': list_of_attributes[12],
+        'frame': list_of_attributes[13],
+        'baseline': list_of_attributes[-1],
+    }
+
+
+def get_granule_names(filenames):
+    """Return sorted names of the .SEN3 granules of the given files."""
+    return sorted({part for fid in filenames for part in Path(fid).parts
+                   if part.endswith('.SEN3')})
+
+
+def get_passage_baseline(filenames):
+    """Return processing baseline (eg. '003') of the granules of a passage.
+
+    :return: str, None if the granules have no or different baselines
+    """
+    baselines = {parse_sen3_name(g)['baseline'] for g in get_granule_names(filenames)}
+    return baselines.pop() if len(baselines) == 1 else None
+
+
+def get_passage_start_time(filenames):
+    """Return start time (pd.Timestamp) of the first granule of a passage."""
+    return pd.Timestamp(min(parse_sen3_name(g)['start_time']
+                            for g in get_granule_names(filenames)))
+
+
+def get_footprint(folder):
+    """Return footprint from the xfdumanifest.xml of a granule.
+
+    :param folder: str, granule folder
+    :return: list of (lat, lon) tuples, empty if the manifest is missing
+    """
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return []
+    with open(path, encoding='utf8') as fd:
+        match = re.search(r'<gml:posList>([^<]+)</gml:posList>', fd.read())
+    if not match:
+        return []
+    values = [float(v) for v in match.group(1).split()]
+    return list(zip(values[0::2], values[1::2]))
+
+
+def get_footprint_from_coordinates(folder, step=100):
+    """Return footprint from the edge pixels of geo_coordinates.nc.
+
+    Only the outer rows and columns (every step pixel) are read.
+
+    :param folder: str, granule folder
+    :param step: int, sampling interval along the edges
+    :return: list of (lat, lon) tuples, empty if the file is missing
+    """
+    path = os.path.join(folder, COORDINATES_FILE)
+    if not os.path.isfile(path):
+        return []
+    with xr.open_dataset(path) as ds:
+        rows, cols = ds['latitude'].shape
+        row_idx = np.unique(np.r_[np.arange(0, rows, step), rows - 1])
+        col_idx = np.unique(np.r_[np.arange(0, cols, step), cols - 1])
+        edges = []
+        for key in ('latitude', 'longitude'):
+            var = ds[key]
+            edges.append(np.concatenate((
+                var[0, col_idx].values,
+                var[row_idx, -1].values,
+                var[-1, col_idx[::-1]].values,
+                var[row_idx[::-1], 0].values,
+            )))
+    valid = np.isfinite(edges[0]) & np.isfinite(edges[1])
+    return list(zip(edges[0][valid], edges[1][valid]))
+
+
+def get_granule_polygon(folder):
+    """Return lon/lat polygon of a granule footprint.
+
+    Read from the xfdumanifest.xml, with geo_coordinates.nc as fallback.
+
+    :param folder: str, granule folder
+    :return: shapely.geometry.Polygon or None if no footprint is found
+    """
+    footprint = get_footprint(folder) or get_footprint_from_coordinates(folder)
+    if len(footprint) < 3:
+        return None
+    return Polygon([(lon, lat) for lat, lon in footprint])
+
+
+def footprint_to_wkt(footprint):
+    """Return WKT polygon (lon lat) of a footprint given as (lat, lon) pairs."""
+    if not footprint:
+        return None
+    coords = ', '.join(f'{lon} {lat}' for lat, lon in footprint)
+    return f'POLYGON (({coords}))'
+
+
+def _to_catalog_time(value):
+    """Return time formatted as in the .SEN3 names (sortable string)."""
+    return pd.Timestamp(value).strftime('%Y%m%dT%H%M%S')
+
+
+class Sen3Catalog:
+    """Persistent catalog (SQLite) of .SEN3 granules in a base directory.
+
+    The catalog is updated incrementally, only granules that are new or
+    whose granule folder modification time has changed are parsed. Granules
+    removed from disk are dropped from the catalog. Records are kept per
+    base directory, so one database can catalog several directories.
+    """
+
+    def __init__(self, db_path, base_dir=None, update=True):
+        self.db_path = db_path
+        self.base_dir = base_dir
+        self.connection = sqlite3.connect(db_path)
+        self._create_tables()
+        if update and base_dir:
+            self.update()
+
+    def _create_tables(self):
+        """Create tables and indices if not existing.
+
+        Catalogs of an older layout (granules not keyed by base_dir) are
+        dropped and rebuilt by the next update.
+        """
+        columns = [row[1] for row in self.connection.execute(
+            'PRAGMA table_info(granules)')]
+        if columns and 'base_dir' not in columns:
+            self.connection.executescript("""
+                DROP TABLE granules;
+                DROP TABLE IF EXISTS state;
+            """)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS granules (
+                base_dir TEXT,
+                directories TEXT,
+                path TEXT,
+                satellite TEXT,
+                start_time TEXT,
+                stop_time TEXT,
+                orbit TEXT,
+                frame TEXT,
+                baseline TEXT,
+                footprint TEXT,
+                lat_min REAL,
+                lat_max REAL,
+                lon_min REAL,
+                lon_max REAL,
+                mtime REAL,
+                PRIMARY KEY (base_dir, directories)
+            );
+            CREATE INDEX IF NOT EXISTS idx_start_time ON granules (start_time);
+            CREATE INDEX IF NOT EXISTS idx_orbit ON granules (orbit, satellite);
+            CREATE INDEX IF NOT EXISTS idx_bbox
+                ON granules (lat_min, lat_max, lon_min, lon_max);
+        """)
+        self.connection.commit()
+
+    def update(self, force=False):
+        """Synchronize the catalog with the base directory.
+
+        The granule directories are listed and the modification time of
+        every granule folder is compared with the catalog, which also picks
+        up granules replaced within existing directories.
+
+        :param force: bool, parse all granules again
+        :return: tuple, number of (added or updated, removed) granules
+        """
+        on_disk = {}
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.SEN3') and entry.is_dir():
+                    on_disk[entry.name] = self._get_mtime(entry)
+        in_catalog = dict(self.connection.execute(
+            'SELECT directories, mtime FROM granules WHERE base_dir = ?',
+            (self.base_dir,)
+        ).fetchall())
+
+        removed = [(self.base_dir, d) for d in in_catalog if d not in on_disk]
+        changed = [self._get_record(d, mtime) for d, mtime in on_disk.items()
+                   if force or in_catalog.get(d) != mtime]
+
+        self.connection.executemany(
+            'DELETE FROM granules WHERE base_dir = ? AND directories = ?',
+            removed)
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO granules ({}) VALUES ({})'.format(
+                ', '.join(CATALOG_COLUMNS), ', '.join('?' * len(CATALOG_COLUMNS))
+            ), changed)
+        self.connection.commit()
+        return len(changed), len(removed)
+
+    @staticmethod
+    def _get_mtime(entry):
+        """Return modification time of a granule, including a nested folder."""
+        mtime = entry.stat().st_mtime
+        nested = os.path.join(entry.path, entry.name)
+        if os.path.isdir(nested):
+            mtime = max(mtime, os.stat(nested).st_mtime)
+        return mtime
+
+    def _get_record(self, directory, mtime):
+        """Return catalog record for one granule."""
+        folder = get_granule_folder(self.base_dir, directory)
+        attributes = parse_sen3_name(directory)
+        footprint = get_footprint(folder)
+        if footprint:
+            lats, lons = zip(*footprint)
+            bbox = (min(lats), max(lats), min(lons), max(lons))
+        else:
+            bbox = (None, None, None, None)
+        attributes.update(
+            base_dir=self.base_dir,
+            directories=directory,
+            path=folder,
+            footprint=footprint_to_wkt(footprint),
+            lat_min=bbox[0], lat_max=bbox[1], lon_min=bbox[2], lon_max=bbox[3],
+            mtime=mtime,
+        )
+        return tuple(attributes[c] for c in CATALOG_COLUMNS)
+
+    def query(self, start=None, end=None, orbit=None, satellite=None,
+              bbox=None):
+        """Return catalog records as a DataFrame.
+
+        :param start: str / datetime, granules starting at or after start
+        :param end: str / datetime, granules starting before end
+        :param orbit: str / int or list of relative orbits
+        :param satellite: str or list, eg. 'S3A'
+        :param bbox: tuple, (lon_min, lat_min, lon_max, lat_max). Granules
+                     without footprint are always included.
+        :return: pandas.DataFrame sorted by start_time, granules of base_dir
+                 only (all granules if base_dir is None)
+        """
+        conditions = []
+        parameters = []
+        if self.base_dir:
+            conditions.append('base_dir = ?')
+            parameters.append(self.base_dir)
+        if start is not None:
+            conditions.append('start_time >= ?')
+            parameters.append(_to_catalog_time(start))
+        if end is not None:
+            conditions.append('start_time < ?')
+            parameters.append(_to_catalog_time(end))
+        for column, value in (('orbit', orbit), ('satellite', satellite)):
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if column == 'orbit':
+                values = [str(v).zfill(3) for v in values]
+            conditions.append('{} IN ({})'.format(
+                column, ', '.join('?' * len(values))))
+            parameters.extend(values)
+        if bbox is not None:
+            conditions.append(
+                '(footprint IS NULL OR (lon_max >= ? AND lon_min <= ? '
+                'AND lat_max >= ? AND lat_min <= ?))')
+            parameters.extend((bbox[0], bbox[2], bbox[1], bbox[3]))
+
+        sql = 'SELECT * FROM granules'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY start_time'
+        return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
 
 
 class Seacher:
     """Doc."""
 
-    def __init__(self, base_dir=None, satpy_reader='olci_l2'):
+    def __init__(self, base_dir=None, satpy_reader='olci_l2',
+                 catalog_path=None, area=None, **query):
+        """Initiate the searcher.
+
+        :param base_dir: str, directory with .SEN3 granules
+        :param satpy_reader: str
+        :param catalog_path: str, path to a Sen3Catalog database. When given,
+                             granules are taken from the (incrementally
+                             updated) catalog instead of listing base_dir.
+        :param area: pyresample AreaDefinition, granules whose footprint
+                     does not intersect the area are excluded before any
+                     data is opened.
+        :param query: keyword arguments passed on to Sen3Catalog.query,
+                      eg. start, end, orbit, satellite, bbox. Without
+                      catalog_path the query runs on an in-memory catalog.
+        """
         self.base_dir = base_dir
         self.satpy_reader = satpy_reader
-        self.df = pd.DataFrame({
-            'directories': [d for d in os.listdir(self.base_dir)
-                            if d.endswith('.SEN3')]
-        })
-        self._set_name_attributes()
+        if catalog_path or query:
+            catalog = Sen3Catalog(catalog_path or ':memory:', base_dir=base_dir)
+            self.df = catalog.query(**query)
+            catalog.close()
+        else:
+            self.df = pd.DataFrame({
+                'directories': sorted(d for d in os.listdir(self.base_dir)
+                                      if d.endswith('.SEN3'))
+            })
+            self._set_name_attributes()
+        if area is not None:
+            self._filter_by_area(area)
+        self.df['start_ts'] = self.df['start_time'].str[:8]
 
         self.passages = {}
         self._set_daily_passages()
@@ -58,47 +383,46 @@ class Seacher:
 
     def _set_name_attributes(self):
         """Doc."""
-        start_ts = []
-        satellite = []
-        orbit = []
-        for d in self.df['directories']:
-            list_of_attributes = d.split('_')
-            satellite.append(list_of_attributes[0])
-            start_ts.append(list_of_attributes[7].split('T')[0])
-            orbit.append(list_of_attributes[12])
-        self.df['satellite'] = satellite
-        self.df['orbit'] = orbit
-        self.df['start_ts'] = start_ts
+        attributes = pd.DataFrame(
+            [parse_sen3_name(d) for d in self.df['directories']],
+            index=self.df.index,
+            columns=['satellite', 'start_time', 'stop_time', 'orbit', 'frame',
+                     'baseline'],
+        )
+        for col in attributes:
+            self.df[col] = attributes[col]
+        self.df['path'] = [get_granule_folder(self.base_dir, d)
+                           for d in self.df['directories']]
+
+    def _filter_by_area(self, area):
+        """Drop granules with a footprint not intersecting the area.
+
+        Granules without any footprint are kept.
+        """
+        area_poly = get_area_polygon(area)
+        if 'footprint' in self.df:
+            polygons = [wkt.loads(f) if f else get_granule_polygon(p)
+                        for f, p in zip(self.df['footprint'], self.df['path'])]
+        else:
+            polygons = [get_granule_polygon(p) for p in self.df['path']]
+        boolean = [poly is None or area_poly.intersects(poly)
+                   for poly in polygons]
+        self.df = self.df.loc[boolean].reset_index(drop=True)
 
     def _set_daily_passages(self):
         """Doc."""
-        for date in self.df['start_ts'].unique():
-            boolean = self.df['start_ts'] == date
-
-            sat_orb_complete = set()
-            for row in self.df[boolean].itertuples():
-                combo = f'{row.satellite}_{row.orbit}'
-                if combo in sat_orb_complete:
-                    continue
-                else:
-                    sat_orb_complete.add(combo)
-
-                boolean_select = boolean & (self.df['orbit'] == row.orbit) \
-                                 & (self.df['satellite'] == row.satellite)
-                self._append_passage(date, combo, boolean_select)
-
-    def _append_passage(self, date, combo, boolean_select):
-        """Doc."""
-        self.passages.setdefault(date, {})
-        for row in self.df[boolean_select].itertuples():
-            file_list = get_file_list(self.base_dir, row.directories)
-            self.passages[date].setdefault(combo, []).extend(file_list)
+        grouped = self.df.groupby(['start_ts', 'satellite', 'orbit'], sort=False)
+        for (date, satellite, orbit), paths in grouped['path']:
+            file_list = [os.path.join(path, f) for path in paths
+                         for f in OLCI_FILES]
+            self.passages.setdefault(date, {})[f'{satellite}_{orbit}'] = file_list
 
 
 if __name__ == '__main__':
     sen3_data_l2 = r'D:\olci_l2_003'
-    searcher = Seacher(base_dir=sen3_data_l2, satpy_reader='olci_l2')
+    searcher = Seacher(base_dir=sen3_data_l2, satpy_reader='olci_l2',
+                       catalog_path=r'D:\olci_l2_003\sen3_catalog.db')
     searcher.passages.keys()
     # searcher.passages[date].keys()
     for fid in searcher.passages['20211224']['S3B_335']:
-        print(os.stat(fid).st_size)
\ No newline at end of file
+        print(os.stat(fid).st_size)
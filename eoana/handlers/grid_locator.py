@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-02 09:14
+
+@author: johannes
+"""
+import numpy as np
+import rasterio as rio
+from pykdtree.kdtree import KDTree
+from eoana.config import Settings
+from eoana.utils import get_transformer
+
+
+def _lonlat_to_cartesian(lons, lats):
+    """Return unit sphere cartesian coordinates (n, 3) for the given positions."""
+    lons = np.radians(np.asarray(lons, dtype=np.float64).ravel())
+    lats = np.radians(np.asarray(lats, dtype=np.float64).ravel())
+    cos_lats = np.cos(lats)
+    return np.column_stack((
+        cos_lats * np.cos(lons),
+        cos_lats * np.sin(lons),
+        np.sin(lats),
+    ))
+
+
+class GridLocator:
+    """Locate grid indices (row, col) for geographical positions.
+
+    Regular grids are inverted analytically by transforming lon/lat into the
+    grid reference system (cached pyproj transformer) and applying the affine
+    geotransform of the grid. Curvilinear grids, given as 2-D latitude and
+    longitude arrays, fall back to a KD-tree nearest neighbour search.
+
+    All positions are handled at once, eg.:
+        locator = GridLocator.from_area_name('baws300_sweref99tm')
+        rows, cols = locator.get_index(lat_array, lon_array)
+
+    Positions outside the grid get index -1.
+    """
+
+    EARTH_RADIUS = 6371000.
+
+    def __init__(self, crs=None, origin=None, pixel_size=None, shape=None,
+                 lat_array=None, lon_array=None, max_distance=None):
+        """Initiate the locator.
+
+        :param crs: pyproj.CRS (or str) of a regular grid
+        :param origin: tuple, (x, y) of the upper left corner of the grid
+        :param pixel_size: tuple, (x_size, y_size) in grid units, both positive
+        :param shape: tuple, (rows, cols)
+        :param lat_array: 2-D array of latitudes (curvilinear grid)
+        :param lon_array: 2-D array of longitudes (curvilinear grid)
+        :param max_distance: float, meters. Curvilinear grids only, positions
+                             further away from any grid point are outside.
+        """
+        self.crs = crs
+        self.origin = origin
+        self.pixel_size = pixel_size
+        self.shape = shape
+        self.max_distance = max_distance
+        self._tree = None
+        if lat_array is not None and lon_array is not None:
+            self.shape = np.shape(lat_array)
+            self._tree = KDTree(_lonlat_to_cartesian(lon_array, lat_array))
+        elif crs is None:
+            raise ValueError('Give either crs, origin, pixel_size and shape '
+                             'or lat_array and lon_array')
+
+    @classmethod
+    def from_area_definition(cls, area_def):
+        """Return locator for a pyresample AreaDefinition."""
+        x_min, _, _, y_max = area_def.area_extent
+        return cls(
+            crs=area_def.crs,
+            origin=(x_min, y_max),
+            pixel_size=(area_def.pixel_size_x, area_def.pixel_size_y),
+            shape=area_def.shape,
+        )
+
+    @classmethod
+    def from_area_name(cls, area_name, settings=None):
+        """Return locator for an area in etc/areas, eg. 'baws300_sweref99tm'."""
+        settings = settings or Settings()
+        return cls.from_area_definition(settings.get_area_definition(area_name))
+
+    @classmethod
+    def from_raster(cls, path):
+        """Return locator for the grid of a raster file (eg. GeoTIFF)."""
+        with rio.open(path) as rst:
+            transform = rst.transform
+            return cls(
+                crs=rst.crs.to_wkt(),
+                origin=(transform.c, transform.f),
+                pixel_size=(transform.a, -transform.e),
+                shape=rst.shape,
+            )
+
+    @classmethod
+    def from_lonlats(cls, lat_array, lon_array, max_distance=None):
+        """Return KD-tree based locator for a curvilinear grid."""
+        return cls(lat_array=lat_array, lon_array=lon_array,
+                   max_distance=max_distance)
+
+    @property
+    def is_regular(self):
+        """Return True if the grid is inverted analytically."""
+        return self._tree is None
+
+    def get_index(self, lat, lon):
+        """Return grid-index (rows, cols) for the given positions.
+
+        :param lat: float or array of latitudes (WGS84)
+        :param lon: float or array of longitudes (WGS84)
+        :return: tuple of int for scalar input, otherwise tuple of int arrays
+                 shaped as the input. Positions outside the grid get -1.
+        """
+        scalar = np.ndim(lat) == 0 and np.ndim(lon) == 0
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if self.is_regular:
+            rows, cols = self._get_regular_index(lat, lon)
+        else:
+            rows, cols = self._get_tree_index(lat, lon)
+        if scalar:
+            return int(rows), int(cols)
+        return rows, cols
+
+    def get_flat_index(self, lat, lon):
+        """Return flat (raveled) grid-index, -1 outside the grid."""
+        rows, cols = self.get_index(np.atleast_1d(lat), np.atleast_1d(lon))
+        flat = rows * self.shape[1] + cols
+        flat[rows < 0] = -1
+        return flat
+
+    def _get_regular_index(self, lat, lon):
+        """Invert the affine geotransform of a regular grid."""
+        x, y = get_transformer('EPSG:4326', self.crs).transform(lon, lat)
+        cols = np.floor((np.asarray(x) - self.origin[0]) / self.pixel_size[0])
+        rows = np.floor((self.origin[1] - np.asarray(y)) / self.pixel_size[1])
+        outside = ~(
+            (rows >= 0) & (rows < self.shape[0]) &
+            (cols >= 0) & (cols < self.shape[1])
+        )
+        rows = np.where(outside, -1, rows).astype(np.int64)
+        cols = np.where(outside, -1, cols).astype(np.int64)
+        return rows, cols
+
+    def _get_tree_index(self, lat, lon):
+        """Nearest neighbour search for curvilinear grids."""
+        points = _lonlat_to_cartesian(lon, lat)
+        if self.max_distance:
+            upper_bound = self.max_distance / self.EARTH_RADIUS
+            _, idx = self._tree.query(points, k=1,
+                                      distance_upper_bound=upper_bound)
+        else:
+            _, idx = self._tree.query(points, k=1)
+        idx = idx.astype(np.int64)
+        outside = idx >= self.shape[0] * self.shape[1]
+        rows, cols = np.divmod(idx, self.shape[1])
+        rows[outside] = -1
+        cols[outside] = -1
+        return rows.reshape(lat.shape), cols.reshape(lat.shape)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-18 10:41
+
+@author: johannes
+"""
+import numpy as np
+from eoana.config import Settings
+
+
+class MaskedGrid:
+    """Vector representation of the valid (sea) pixels of a grid.
+
+    Only the pixels where the mask is True are stored, as a 1-D array in
+    the order of the sorted flat (raveled) grid index shared by all vectors
+    of the grid. Memory and arithmetic scale with the number of sea pixels
+    rather than the full rectangle.
+
+    Usage:
+        grid = MaskedGrid.from_settings('helcom_ospar.tiff')
+        values = grid.compress(dense_array)
+        dense_array = grid.expand(values)
+    """
+
+    def __init__(self, mask):
+        """Initiate the grid.
+
+        :param mask: 2-D boolean array, True for valid pixels
+        """
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.index = np.flatnonzero(mask)
+
+    @classmethod
+    def from_zone_grid(cls, zone_grid, nodata=0):
+        """Return grid of the pixels with a zone (zone id > nodata)."""
+        zone_grid = np.asarray(zone_grid)
+        return cls(np.isfinite(zone_grid) & (zone_grid > nodata))
+
+    @classmethod
+    def from_settings(cls, file_name='helcom_ospar.tiff', settings=None, **kwargs):
+        """Return grid of a zone grid in etc/basin_grid, see from_zone_grid."""
+        settings = settings or Settings()
+        return cls.from_zone_grid(settings.get_zone_grid(file_name), **kwargs)
+
+    @property
+    def size(self):
+        """Number of valid pixels."""
+        return self.index.size
+
+    @property
+    def mask(self):
+        """Return 2-D boolean mask of the valid pixels."""
+        mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        mask[self.index] = True
+        return mask.reshape(self.shape)
+
+    def compress(self, array, dtype=None):
+        """Return values of the valid pixels of a dense 2-D array."""
+        values = np.asarray(array).ravel()[self.index]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def expand(self, values, fill_value=np.nan, dtype=None):
+        """Return dense 2-D array, fill_value outside the valid pixels."""
+        values = np.asarray(values)
+        array = np.full(self.shape[0] * self.shape[1], fill_value,
+                        dtype=dtype or values.dtype)
+        array[self.index] = values
+        return array.reshape(self.shape)
+
+    def get_position(self, rows, cols):
+        """Return vector position of grid indices, -1 outside the valid pixels.
+
+        :param rows: int array, grid rows (-1 outside the grid)
+        :param cols: int array, grid columns
+        :return: int array shaped as rows
+        """
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        inside = (rows >= 0) & (rows < self.shape[0]) & \
+            (cols >= 0) & (cols < self.shape[1])
+        flat = np.where(inside, rows * self.shape[1] + cols, -1)
+        position = np.searchsorted(self.index, flat)
+        position = np.minimum(position, max(self.size - 1, 0))
+        valid = inside & (self.index[position] == flat) if self.size else inside & False
+        return np.where(valid, position, -1)
+
+    def take(self, values, rows, cols, fill_value=np.nan):
+        """Return values at grid indices, fill_value outside the valid pixels."""
+        position = self.get_position(rows, cols)
+        result = np.full(position.shape, fill_value,
+                         dtype=np.result_type(values.dtype, type(fill_value)))
+        valid = position >= 0
+        result[valid] = values[position[valid]]
+        return result
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-11 10:05
+
+@author: johannes
+"""
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from eoana.readers.geotiff import read_band, get_legacy_nan_value
+from eoana.handlers.composite import CompositeAccumulator
+from eoana.handlers.neighbourhood import get_window_statistics
+
+
+def read_raster(path, nan_value=None, band=1):
+    """Return float32 array of a raster band, nodata and nan_value as nan.
+
+    0 is nan in unpacked float rasters, see get_legacy_nan_value.
+    """
+    with rio.open(path) as rst:
+        array = read_band(rst, band=band,
+                          nan_value=get_legacy_nan_value(rst, band))
+    if nan_value is not None:
+        array[array == nan_value] = np.nan
+    return array
+
+
+def get_window_values(array, rows, cols, size=3, grid=None):
+    """Return the values of size x size windows centred on grid indices.
+
+    Window pixels outside the grid (and positions with index -1) are nan.
+
+    :param array: 2-D float array (or vector of the valid pixels of grid)
+    :param rows: int array, grid rows
+    :param cols: int array, grid columns
+    :param size: int, odd window size
+    :param grid: MaskedGrid, when array is a vector of its valid pixels
+    :return: array (n_positions, size * size)
+    """
+    if size % 2 != 1:
+        raise ValueError('Window size must be odd, not %s' % size)
+    half = size // 2
+    offsets = np.arange(-half, half + 1)
+    window_rows = (np.asarray(rows)[:, np.newaxis, np.newaxis] +
+                   offsets[np.newaxis, :, np.newaxis])
+    window_cols = (np.asarray(cols)[:, np.newaxis, np.newaxis] +
+                   offsets[np.newaxis, np.newaxis, :])
+    window_rows, window_cols = np.broadcast_arrays(window_rows, window_cols)
+    shape = grid.shape if grid is not None else array.shape
+    inside = (
+        (window_rows >= 0) & (window_rows < shape[0]) &
+        (window_cols >= 0) & (window_cols < shape[1])
+    )
+    inside &= (np.asarray(rows) >= 0)[:, np.newaxis, np.newaxis]
+    values = np.full(window_rows.shape, np.nan, dtype=np.float32)
+    if grid is not None:
+        values[inside] = grid.take(array, window_rows[inside], window_cols[inside])
+    else:
+        values[inside] = array[window_rows[inside], window_cols[inside]]
+    return values.reshape(len(values), -1)
+
+
+class Matchup:
+    """Match in-situ observations with satellite rasters.
+
+    Grid indices of all positions are resolved in one call (GridLocator).
+    Each raster is read once and the centre pixel and the size x size window
+    statistics of every observation on that date are gathered with fancy
+    indexing.
+
+    With a MaskedGrid daily means are composited as vectors of its valid
+    pixels only.
+
+    With precompute=True window mean, count and cv rasters are computed for
+    the whole raster (eoana.handlers.neighbourhood) and each observation is
+    a single lookup, worthwhile for many observations per raster. The planes
+    of the last cache_size rasters are kept and reused by later match calls.
+
+    Two modes:
+        time_tolerance=None: daily mean of all passages of the observation date
+        time_tolerance='3h': the passage closest in time, within the tolerance
+
+    Usage:
+        locator = GridLocator.from_area_name('baws300_sweref99tm')
+        matchup = Matchup(locator, RasterFileIndex('/olci_output/helcom'))
+        df = matchup.match(lats, lons, timestamps, time_tolerance='3h')
+    """
+
+    def __init__(self, locator, raster_index, window_size=3, nan_value=None,
+                 parameter=None, precompute=False, grid=None, cache_size=2,
+                 log10=True):
+        """Initiate the matchup.
+
+        :param locator: GridLocator of the raster grid
+        :param raster_index: eoana.utils.RasterFileIndex of the rasters
+        :param window_size: int, odd window size, eg. 3 for 3x3
+        :param nan_value: value treated as missing besides nan
+        :param parameter: str, only rasters of this parameter, eg. 'chl_nn'
+        :param precompute: bool, look up window statistics in precomputed
+                           rasters instead of gathering the windows
+        :param grid: MaskedGrid (eg. sea pixels) of the raster grid
+        :param cache_size: int, number of rasters with precomputed planes kept
+        :param log10: bool, rasters hold log10 values (eg. chl_nn), the
+                      window cv is computed on the linear values
+        """
+        self.locator = locator
+        self.raster_index = raster_index
+        self.window_size = window_size
+        self.nan_value = nan_value
+        self.parameter = parameter
+        self.precompute = precompute
+        self.grid = grid
+        self.cache_size = cache_size
+        self.log10 = log10
+        self._planes = {}
+
+    def get_planes(self, array, key=None):
+        """Return value and window statistic planes, cached per key.
+
+        :param array: 2-D array (or masked grid vector), None if key is cached
+        :param key: hashable, eg. raster path. None: not cached
+        :return: dict of 2-D arrays, value, mean, count and cv
+        """
+        if key is not None and key in self._planes:
+            return self._planes[key]
+        if np.ndim(array) == 1 and self.grid is not None:
+            array = self.grid.expand(array)
+        planes = get_window_statistics(array, size=self.window_size,
+                                       log10=self.log10)
+        planes['value'] = np.asarray(array, dtype=np.float32)
+        if key is not None and self.cache_size > 0:
+            if len(self._planes) >= self.cache_size:
+                self._planes.pop(next(iter(self._planes)))
+            self._planes[key] = planes
+        return planes
+
+    def is_cached(self, key):
+        """Return True if precomputed planes of key are available."""
+        return self.precompute and key in self._planes
+
+    def extract(self, array, rows, cols, key=None):
+        """Return centre value and window mean, count and cv (std / mean).
+
+        With log10 the cv is std / mean of the linear values (10 ** x).
+
+        :param array: 2-D array on the grid of the locator, missing as nan
+                      (or vector of the valid pixels of the masked grid).
+                      None if the planes of key are cached.
+        :param rows: int array, grid rows (-1 outside the grid)
+        :param cols: int array, grid columns
+        :param key: hashable, eg. raster path, to cache precomputed planes
+        :return: tuple of arrays (value, window_mean, window_count, window_cv)
+        """
+        if self.precompute:
+            planes = self.get_planes(array, key=key)
+            inside = rows >= 0
+            rows, cols = np.where(inside, rows, 0), np.where(inside, cols, 0)
+            value = np.where(inside, planes['value'][rows, cols], np.nan)
+            return (value,
+                    np.where(inside, planes['mean'][rows, cols], np.nan),
+                    np.where(inside, planes['count'][rows, cols], 0),
+                    np.where(inside, planes['cv'][rows, cols], np.nan))
+
+        grid = self.grid if np.ndim(array) == 1 else None
+        window = get_window_values(array, rows, cols, size=self.window_size,
+                                   grid=grid)
+        value = window[:, window.shape[1] // 2]
+        count = np.isfinite(window).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            mean = np.nansum(window, axis=1) / count
+            linear = np.power(10., window) if self.log10 else window
+            linear_mean = np.nansum(linear, axis=1) / count
+            std = np.sqrt(np.nansum(
+                np.square(linear - linear_mean[:, np.newaxis]), axis=1) / count)
+        return value, mean, count, std / linear_mean
+
+    def match(self, lat, lon, time, time_tolerance=None):
+        """Return satellite values for in-situ observations.
+
+        :param lat: array of latitudes (WGS84)
+        :param lon: array of longitudes (WGS84)
+        :param time: array of timestamps (datetime like or str)
+        :param time_tolerance: None (daily mean) or pd.Timedelta / str,
+                               eg. '3h'. Max time difference to a passage.
+        :return: pandas.DataFrame (one row per observation, same order)
+                 with value, window_mean, window_count, window_cv and, for a time
+                 tolerance, passage and time_diff columns
+        """
+        rows, cols = self.locator.get_index(np.asarray(lat, dtype=float),
+                                            np.asarray(lon, dtype=float))
+        time = pd.DatetimeIndex(pd.to_datetime(np.asarray(time)))
+        result = {
+            'value': np.full(len(time), np.nan, dtype=np.float32),
+            'window_mean': np.full(len(time), np.nan, dtype=np.float32),
+            'window_count': np.zeros(len(time), dtype=np.int32),
+            'window_cv': np.full(len(time), np.nan, dtype=np.float32),
+        }
+        if time_tolerance is None:
+            self._match_daily(result, rows, cols, time)
+        else:
+            self._match_passages(result, rows, cols, time,
+                                 pd.Timedelta(time_tolerance))
+        return pd.DataFrame(result)
+
+    def _set_values(self, result, selection, array, rows, cols, key=None):
+        """Extract values for the selected observations into result."""
+        value, mean, count, cv = self.extract(array, rows[selection],
+                                              cols[selection], key=key)
+        result['value'][selection] = value
+        result['window_mean'][selection] = mean
+        result['window_count'][selection] = count
+        result['window_cv'][selection] = cv
+
+    def _match_daily(self, result, rows, cols, time):
+        """Daily mean of all passages per observation date."""
+        dates, inverse = np.unique(time.strftime('%Y%m%d'), return_inverse=True)
+        on_grid = rows >= 0
+        for i, date in enumerate(dates):
+            selection = np.flatnonzero((inverse == i) & on_grid)
+            if not selection.size:
+                continue
+            files = self.raster_index.get_date(date, parameter=self.parameter)
+            if not files:
+                continue
+            key = tuple(files)
+            array = None
+            if not self.is_cached(key):
+                accumulator = CompositeAccumulator.from_raster(
+                    files[0], nan_value=self.nan_value, grid=self.grid)
+                accumulator.add_files(files)
+                array = accumulator.mean()
+            self._set_values(result, selection, array, rows, cols, key=key)
+
+    def _match_passages(self, result, rows, cols, time, tolerance):
+        """Passage closest in time within the tolerance per observation.
+
+        Passages without valid pixels in the window of an observation are
+        not considered for that observation.
+        """
+        passage = np.full(len(time), None, dtype=object)
+        best_diff = np.full(len(time), np.inf)
+        order = np.argsort(time.values, kind='stable')
+        sorted_times = time.values[order]
+        records = self.raster_index.get_records(
+            start=(time.min() - tolerance) if len(time) else None,
+            end=(time.max() + tolerance) if len(time) else None,
+            parameter=self.parameter,
+        )
+        tolerance = tolerance.to_timedelta64()
+        for record in records:
+            if not record['time']:
+                continue
+            passage_time = np.datetime64(
+                pd.Timestamp(f"{record['date']} {record['time']}"))
+            lo = np.searchsorted(sorted_times, passage_time - tolerance,
+                                 side='left')
+            hi = np.searchsorted(sorted_times, passage_time + tolerance,
+                                 side='right')
+            candidates = order[lo:hi]
+            candidates = candidates[rows[candidates] >= 0]
+            if not candidates.size:
+                continue
+            diff = np.abs((time.values[candidates] - passage_time) /
+                          np.timedelta64(1, 's'))
+            closer = diff < best_diff[candidates]
+            if not closer.any():
+                continue
+            candidates, diff = candidates[closer], diff[closer]
+            path = record['path']
+            value, mean, count, cv = self.extract(
+                None if self.is_cached(path)
+                else read_raster(path, nan_value=self.nan_value),
+                rows[candidates], cols[candidates], key=path)
+            valid = count > 0
+            selection = candidates[valid]
+            result['value'][selection] = value[valid]
+            result['window_mean'][selection] = mean[valid]
+            result['window_count'][selection] = count[valid]
+            result['window_cv'][selection] = cv[valid]
+            best_diff[selection] = diff[valid]
+            passage[selection] = record['passage']
+        result['passage'] = passage
+        result['time_diff'] = pd.to_timedelta(
+            np.where(np.isfinite(best_diff), best_diff, np.nan), unit='s')
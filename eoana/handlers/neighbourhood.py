@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-14 08:36
+
+@author: johannes
+"""
+import numpy as np
+
+
+def _window_sum(array, size):
+    """Return the sum of every size x size window (zero padded) of array.
+
+    Computed from an integral image (summed-area table), four lookups per
+    pixel regardless of the window size.
+    """
+    half = size // 2
+    rows, cols = array.shape
+    integral = np.zeros((rows + 2 * half + 1, cols + 2 * half + 1),
+                        dtype=array.dtype)
+    integral[half + 1:rows + half + 1, half + 1:cols + half + 1] = array
+    np.cumsum(integral, axis=0, out=integral)
+    np.cumsum(integral, axis=1, out=integral)
+    return (integral[size:, size:] - integral[:-size, size:] -
+            integral[size:, :-size] + integral[:-size, :-size])
+
+
+def _get_mean_var(valid, values, size):
+    """Return window count, mean and population variance of values."""
+    # Values are shifted by the overall mean to limit cancellation errors
+    # in sum of squares - square of sum.
+    shift = values[valid].mean() if valid.any() else 0.
+    values = np.where(valid, values - shift, 0.)
+
+    count = _window_sum(valid.astype(np.int32), size)
+    total = _window_sum(values, size)
+    total_sq = _window_sum(np.square(values), size)
+
+    has_values = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shifted_mean = np.where(has_values, total / count, np.nan)
+        var = np.where(has_values, total_sq / count - np.square(shifted_mean),
+                       np.nan)
+    return count, shifted_mean + shift, np.maximum(var, 0.)
+
+
+def get_window_statistics(array, size=3, nan_value=None, log10=False):
+    """Return NaN-aware window statistic rasters of a 2-D array.
+
+    Every pixel gets the statistics of the valid pixels of the size x size
+    window centred on it. Pixels outside the grid do not count, so edge
+    windows are simply smaller. Runs in O(pixels) for any window size.
+
+    :param array: 2-D array, missing values as nan or nan_value
+    :param size: int, odd window size, eg. 3 for 3x3
+    :param nan_value: value treated as missing besides nan, eg. 0
+    :param log10: bool, array holds log10 values (eg. chl_nn). The mean is
+                  the mean of the log10 values, the cv is computed on the
+                  linear values (10 ** array).
+    :return: dict of 2-D arrays, mean and cv (std / mean) as float32
+             (nan where count is 0) and count as int32
+    """
+    if size % 2 != 1 or size < 1:
+        raise ValueError('Window size must be a positive odd number, not %s'
+                         % size)
+    array = np.asarray(array, dtype=np.float64)
+    valid = np.isfinite(array)
+    if nan_value is not None:
+        valid &= array != nan_value
+
+    count, mean, var = _get_mean_var(valid, array, size)
+    if log10:
+        with np.errstate(invalid='ignore', over='ignore'):
+            _, linear_mean, linear_var = _get_mean_var(
+                valid, np.power(10., array), size)
+    else:
+        linear_mean, linear_var = mean, var
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.sqrt(linear_var) / linear_mean
+
+    return {
+        'mean': mean.astype(np.float32),
+        'count': count,
+        'cv': cv.astype(np.float32),
+    }
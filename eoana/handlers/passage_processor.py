@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-04 10:21
+
+@author: johannes
+"""
+import os
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobManifest:
+    """Job states stored in a json file.
+
+    Each job is a dictionary with at least:
+        state: pending / running / done / failed
+        inputs: list of input files
+        output: expected output file (None if nothing is written)
+        outputs: list of additional output files
+        attempts, started, finished, duration, error
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as fd:
+                self.jobs = json.load(fd)
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def get(self, job_id):
+        """Return job dictionary."""
+        return self.jobs.get(job_id)
+
+    def update(self, job_id, **kwargs):
+        """Update job information."""
+        self.jobs.setdefault(job_id, {}).update(kwargs)
+
+    def save(self):
+        """Write the manifest (atomic replace)."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(self.jobs, fd, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        """Return number of jobs per state."""
+        states = {}
+        for job in self.jobs.values():
+            states[job.get('state')] = states.get(job.get('state'), 0) + 1
+        return states
+
+
+def _run_job(process_func, job_id, job):
+    """Run one job in a worker, exceptions are returned, not raised."""
+    start_time = time.time()
+    try:
+        result = process_func(job)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return job_id, result, error, start_time, time.time()
+
+
+class PassageProcessor:
+    """Process passages in parallel with a resumable job manifest.
+
+    Usage:
+        processor = PassageProcessor(process_passage, 'manifest.json',
+                                     max_workers=32)
+        processor.add_job('20211224_S3B_335', inputs=[...], output='...tiff')
+        processor.run()
+
+    process_func is called with the job dictionary and must be picklable
+    (defined at module level). It may return a dictionary that is stored
+    with the job, eg. {'output': None} when nothing was written, or
+    {'outputs': [...]} to record additional output files.
+
+    Jobs that are done, with all recorded outputs existing and newer than
+    all inputs, are skipped. Jobs left as running (eg. after a crash) are processed again.
+    Failed jobs are retried up to max_retries times per run.
+    """
+
+    def __init__(self, process_func, manifest_path, max_workers=None,
+                 max_retries=2, save_interval=10.):
+        """Initiate the processor.
+
+        :param process_func: callable, process_func(job) -> dict or None
+        :param manifest_path: str, json file of job states
+        :param max_workers: int, number of processes (default: cpu count)
+        :param max_retries: int, retries of failed jobs per run
+        :param save_interval: float, min seconds between manifest writes
+        """
+        self.process_func = process_func
+        self.manifest = JobManifest(manifest_path)
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_retries = max_retries
+        self.save_interval = save_interval
+        self.queue = []
+        self._last_save = 0.
+
+    def add_job(self, job_id, inputs=None, output=None, outputs=None, **kwargs):
+        """Add a job to the queue unless it is up to date.
+
+        :param job_id: str, eg. '20211224_S3B_335'
+        :param inputs: list of input files
+        :param output: str, expected output file
+        :param outputs: list of additional expected output files
+        :param kwargs: additional job arguments passed on to process_func
+        :return: bool, True if the job was queued
+        """
+        inputs = list(inputs or [])
+        if job_id in self.manifest and self.is_up_to_date(job_id, inputs, output):
+            return False
+        self.manifest.update(job_id, state=PENDING, inputs=inputs,
+                             output=output, outputs=list(outputs or []),
+                             attempts=0, error=None, **kwargs)
+        self.queue.append(job_id)
+        return True
+
+    def is_up_to_date(self, job_id, inputs, output):
+        """Return True if the job is done and all its outputs are newer than its inputs."""
+        job = self.manifest.get(job_id)
+        if job.get('state') != DONE or job.get('inputs') != inputs:
+            return False
+        outputs = [f for f in [job.get('output', output)] + job.get('outputs', [])
+                   if f]
+        if not all(os.path.isfile(f) for f in outputs):
+            return False
+        input_mtime = max((os.stat(f).st_mtime for f in inputs
+                           if os.path.exists(f)), default=0.)
+        if outputs:
+            return min(os.stat(f).st_mtime for f in outputs) >= input_mtime
+        return (job.get('finished') or 0.) >= input_mtime
+
+    def run(self):
+        """Process all queued jobs.
+
+        The manifest is always saved on exit. If a worker dies (eg. out of
+        memory) its jobs are marked as failed (retried up to max_retries
+        times) and the remaining jobs continue in a new process pool.
+
+        :return: dict, number of jobs per state
+        """
+        attempts = {job_id: 0 for job_id in self.queue}
+        queue, self.queue = self.queue, []
+        try:
+            if self.max_workers == 1:
+                while queue:
+                    job_id = queue.pop(0)
+                    self._set_running(job_id, attempts)
+                    outcome = _run_job(self.process_func, job_id,
+                                       self.manifest.get(job_id))
+                    if self._set_result(*outcome, attempts=attempts):
+                        queue.append(job_id)
+            else:
+                while queue:
+                    queue = self._run_pool(queue, attempts)
+        finally:
+            self._save(force=True)
+        return self.manifest.summary()
+
+    def _run_pool(self, queue, attempts):
+        """Process jobs in a process pool until done or the pool breaks.
+
+        :return: list, jobs left to run in a new pool (broken pool)
+        """
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            while queue or futures:
+                for job_id in queue:
+                    self._set_running(job_id, attempts)
+                    futures[executor.submit(
+                        _run_job, self.process_func, job_id,
+                        self.manifest.get(job_id))] = job_id
+                queue = []
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        continue
+                    job_id = futures.pop(future)
+                    if self._set_result(*outcome, attempts=attempts):
+                        queue.append(job_id)
+                if broken:
+                    # All jobs still in the pool are lost.
+                    return queue + self._set_broken(futures.values(), attempts)
+        return queue
+
+    def _set_broken(self, job_ids, attempts):
+        """Mark the jobs of a broken pool as failed, return jobs to retry."""
+        retry = []
+        now = time.time()
+        for job_id in job_ids:
+            if self._set_result(job_id, None, 'BrokenProcessPool: worker '
+                                'terminated abruptly', now, now,
+                                attempts=attempts):
+                retry.append(job_id)
+        return retry
+
+    def _save(self, force=False):
+        """Write the manifest, at most once every save_interval seconds."""
+        if force or time.time() - self._last_save >= self.save_interval:
+            self.manifest.save()
+            self._last_save = time.time()
+
+    def _set_running(self, job_id, attempts):
+        attempts[job_id] += 1
+        job = self.manifest.get(job_id)
+        self.manifest.update(job_id, state=RUNNING,
+                             attempts=job.get('attempts', 0) + 1)
+        self._save()
+
+    def _set_result(self, job_id, result, error, start_time, end_time,
+                    attempts=None):
+        """Store outcome of a job, return True if it should be retried."""
+        info = dict(started=start_time, finished=end_time,
+                    duration=round(end_time - start_time, 2))
+        if error is None:
+            info.update(state=DONE, error=None)
+            if isinstance(result, dict):
+                info.update(result)
+        else:
+            info.update(state=FAILED, error=error)
+        self.manifest.update(job_id, **info)
+        self._save()
+        if error is None:
+            print(f'{job_id} done -- {info["duration"]} sec')
+            return False
+        print(f'{job_id} failed (attempt {attempts[job_id]})')
+        return attempts[job_id] <= self.max_retries
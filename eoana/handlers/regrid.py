@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-21 09:05
+
+@author: johannes
+"""
+import os
+import numpy as np
+from eoana.handlers.resample_cache import save_table
+from eoana.utils import get_transformer
+
+
+def _get_pixel_centres(area_def, axis):
+    """Return x (axis=1) or y (axis=0) coordinates of the pixel centres."""
+    x_min, y_min, x_max, y_max = area_def.area_extent
+    if axis == 1:
+        return x_min + (np.arange(area_def.width) + .5) * area_def.pixel_size_x
+    return y_max - (np.arange(area_def.height) + .5) * area_def.pixel_size_y
+
+
+def get_regrid_table(source_def, target_def, block_size=512):
+    """Return flat (source_index, target_index) of source pixels within the target.
+
+    Every source pixel is assigned to the target pixel containing its
+    centre. Source and target may have different extents, pixel sizes
+    (any ratio) and reference systems.
+
+    :param source_def: pyresample AreaDefinition, fine grid
+    :param target_def: pyresample AreaDefinition, coarser grid
+    :param block_size: int, source rows transformed at a time
+    :return: tuple of int32 arrays
+    """
+    xs = _get_pixel_centres(source_def, axis=1)
+    ys = _get_pixel_centres(source_def, axis=0)
+    x_min, _, _, y_max = target_def.area_extent
+    transformer = None
+    if source_def.crs != target_def.crs:
+        transformer = get_transformer(source_def.crs, target_def.crs)
+
+    source_index = []
+    target_index = []
+    for start in range(0, ys.size, block_size):
+        x, y = np.meshgrid(xs, ys[start:start + block_size])
+        if transformer is not None:
+            x, y = transformer.transform(x, y)
+        with np.errstate(invalid='ignore'):
+            cols = np.floor((x - x_min) / target_def.pixel_size_x)
+            rows = np.floor((y_max - y) / target_def.pixel_size_y)
+            inside = (rows >= 0) & (rows < target_def.height) & \
+                (cols >= 0) & (cols < target_def.width)
+        position = np.flatnonzero(inside)
+        source_index.append(position + start * xs.size)
+        target_index.append(rows.ravel()[position].astype(np.int64) *
+                            target_def.width + cols.ravel()[position].astype(np.int64))
+    return (np.concatenate(source_index).astype(np.int32),
+            np.concatenate(target_index).astype(np.int32))
+
+
+class GridAggregator:
+    """Derive coarser grids from one fine (resampled) grid.
+
+    The fine grid is aggregated (NaN-aware mean and count of the fine pixels
+    within each target pixel) with a lookup table per pair of grids, see
+    get_regrid_table. Tables are computed once and kept in memory, and on
+    disk if cache_dir is given. Target grids that are not coarser than the
+    source get pixels without any fine pixel (nan).
+
+    Usage:
+        aggregator = GridAggregator(cache_dir)
+        result = aggregator.aggregate(array, source_def, target_def)
+        result['mean'], result['count']
+    """
+
+    def __init__(self, cache_dir=None):
+        """Initiate the aggregator.
+
+        :param cache_dir: str, directory for the .npz tables
+        """
+        self.cache_dir = cache_dir
+        self._tables = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_table(self, source_def, target_def):
+        """Return (source_index, target_index) for the grids."""
+        key = f'{source_def.area_id}_to_{target_def.area_id}'
+        if key in self._tables:
+            return self._tables[key]
+        shapes = np.array(source_def.shape + target_def.shape)
+        path = os.path.join(self.cache_dir, f'{key}.npz') if self.cache_dir else None
+        table = None
+        if path and os.path.isfile(path):
+            with np.load(path) as cached:
+                if np.array_equal(cached['shapes'], shapes):
+                    table = cached['source_index'], cached['target_index']
+        if table is None:
+            table = get_regrid_table(source_def, target_def)
+            if path:
+                save_table(path, source_index=table[0], target_index=table[1],
+                           shapes=shapes)
+        self._tables[key] = table
+        return table
+
+    def aggregate(self, data, source_def, target_def, min_count=1):
+        """Return mean and count of the valid fine pixels per target pixel.
+
+        :param data: 2-D array on source_def, missing values as nan
+        :param source_def: pyresample AreaDefinition
+        :param target_def: pyresample AreaDefinition
+        :param min_count: int, fewer valid fine pixels gives a nan mean
+        :return: dict, mean (float32) and count (int32) on target_def
+        """
+        source_index, target_index = self.get_table(source_def, target_def)
+        values = np.asarray(data).ravel()[source_index]
+        valid = np.isfinite(values)
+        size = target_def.height * target_def.width
+        count = np.bincount(target_index[valid], minlength=size)
+        total = np.bincount(target_index[valid], weights=values[valid],
+                            minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count >= max(min_count, 1), total / count, np.nan)
+        return {
+            'mean': mean.astype(np.float32).reshape(target_def.shape),
+            'count': count.astype(np.int32).reshape(target_def.shape),
+        }
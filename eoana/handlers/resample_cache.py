@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-03 13:40
+
+@author: johannes
+"""
+import os
+import tempfile
+import numpy as np
+import xarray as xr
+from pyresample.kd_tree import get_neighbour_info
+from eoana.handlers.file_searcher import get_granule_names, parse_sen3_name
+from eoana.utils import get_transformer
+
+
+def get_resample_key(filenames, area_name):
+    """Return cache key for a passage.
+
+    Sentinel-3 repeats its ground track every 27 days, the key is built from
+    satellite, relative orbit and the along-track frames of the granules.
+
+    :param filenames: list of file paths within .SEN3 granules
+    :param area_name: str, name of the target area
+    :return: str, eg. 'S3A_349_1980-2160_baws300_sweref99tm'
+    """
+    attributes = [parse_sen3_name(g) for g in get_granule_names(filenames)]
+    frames = '-'.join(sorted({a['frame'] for a in attributes}))
+    return '_'.join((attributes[0]['satellite'], attributes[0]['orbit'],
+                     frames, area_name))
+
+
+def _get_bounds(inside, step, size):
+    """Return slice of the full resolution lines around the inside samples."""
+    index = np.flatnonzero(inside)
+    return slice(max(int(index[0] - 1) * step, 0),
+                 min(int(index[-1] + 1) * step + 1, size))
+
+
+def get_crop_slices(swath_def, area_def, margin=0., step=32):
+    """Return (row slice, col slice) of the swath covering the area.
+
+    The geolocation is checked every step rows / cols and the slices are
+    extended by one step on each side, so the area must be larger than
+    step swath pixels. Slice bounds are multiples of step (or the swath
+    edges), which keeps the shape of the cropped swath stable between
+    repeat passes (see ResampleCache).
+
+    :param swath_def: pyresample SwathDefinition
+    :param area_def: pyresample AreaDefinition (projected)
+    :param margin: float, meters added around the area extent,
+                   eg. the radius of influence
+    :param step: int, row/col interval of the geolocation check
+    :return: tuple of slices, None if the swath does not cover the area
+    """
+    lons = np.asarray(swath_def.lons[::step, ::step], dtype=np.float64)
+    lats = np.asarray(swath_def.lats[::step, ::step], dtype=np.float64)
+    x, y = get_transformer('EPSG:4326', area_def.crs).transform(lons, lats)
+    x_min, y_min, x_max, y_max = area_def.area_extent
+    with np.errstate(invalid='ignore'):
+        inside = (x >= x_min - margin) & (x <= x_max + margin) & \
+            (y >= y_min - margin) & (y <= y_max + margin)
+    if not inside.any():
+        return None
+    rows, cols = swath_def.shape
+    return (_get_bounds(inside.any(axis=1), step, rows),
+            _get_bounds(inside.any(axis=0), step, cols))
+
+
+def save_table(path, **arrays):
+    """Write arrays to an .npz file atomically.
+
+    The file is written next to path and then renamed, so that other
+    processes never read a partly written table.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            np.savez(fid, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ResampleCache:
+    """Disk cache of nearest neighbour lookup tables (swath -> area).
+
+    For every key (satellite, relative orbit, frames, target area) the
+    cache stores the flat source and target indices of the neighbour search
+    together with a subsampled lon/lat signature of the swath. The table is
+    reused when the swath has the same shape and its signature is within
+    tolerance (degrees), otherwise it is computed again and replaced.
+    Resampling then becomes a gather operation.
+    """
+
+    def __init__(self, cache_dir, tolerance=0.0025, signature_step=64):
+        """Initiate the cache.
+
+        :param cache_dir: str, directory for the .npz tables
+        :param tolerance: float, max allowed lon/lat difference (degrees)
+                          between the cached and the current swath
+        :param signature_step: int, row/col interval of the signature
+        """
+        self.cache_dir = cache_dir
+        self.tolerance = tolerance
+        self.signature_step = signature_step
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def _get_signature(self, swath_def):
+        """Return subsampled lons and lats of the swath."""
+        step = self.signature_step
+        lons = np.asarray(swath_def.lons[::step, ::step], dtype=np.float32)
+        lats = np.asarray(swath_def.lats[::step, ::step], dtype=np.float32)
+        return np.stack((lons, lats))
+
+    def _load(self, key, swath_shape, signature):
+        """Return cached table if it matches the swath geometry."""
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as table:
+            if tuple(table['swath_shape']) != tuple(swath_shape) or \
+                    table['signature'].shape != signature.shape:
+                return None
+            with np.errstate(invalid='ignore'):
+                difference = np.nanmax(np.abs(table['signature'] - signature))
+            # nan: no valid geolocation to compare with.
+            if not np.isfinite(difference) or difference > self.tolerance:
+                return None
+            return table['source_index'], table['target_index']
+
+    def get_lookup_table(self, key, swath_def, area_def, radius_of_influence):
+        """Return flat (source_index, target_index) for the swath and area.
+
+        :param key: str, see get_resample_key
+        :param swath_def: pyresample SwathDefinition
+        :param area_def: pyresample AreaDefinition
+        :param radius_of_influence: float, meters
+        :return: tuple of int32 arrays
+        """
+        signature = self._get_signature(swath_def)
+        table = self._load(key, swath_def.shape, signature)
+        if table is not None:
+            return table
+
+        valid_input, valid_output, index_array, _ = get_neighbour_info(
+            swath_def, area_def, radius_of_influence, neighbours=1)
+        input_positions = np.flatnonzero(valid_input)
+        matched = index_array < input_positions.size
+        source_index = input_positions[index_array[matched]].astype(np.int32)
+        target_index = np.flatnonzero(valid_output)[matched].astype(np.int32)
+
+        save_table(self._get_path(key), source_index=source_index,
+                   target_index=target_index, signature=signature,
+                   swath_shape=np.array(swath_def.shape))
+        return source_index, target_index
+
+    @staticmethod
+    def gather(data, source_index, target_index, output_shape, fill_value=np.nan):
+        """Return data resampled with a lookup table."""
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.integer) and isinstance(fill_value, float):
+            fill_value = 0
+        output = np.full(int(np.prod(output_shape)), fill_value, dtype=data.dtype)
+        output[target_index] = data.ravel()[source_index]
+        return output.reshape(output_shape)
+
+
+def resample_scene(scn, area_def, cache=None, key=None, radius_of_influence=500,
+                   datasets=None, fill_value=None):
+    """Return scene resampled to area_def.
+
+    Uses the lookup tables of the ResampleCache when cache and key are given,
+    otherwise falls back on satpy Scene.resample.
+
+    :param scn: satpy Scene with swath datasets
+    :param area_def: pyresample AreaDefinition
+    :param cache: ResampleCache
+    :param key: str, see get_resample_key
+    :param radius_of_influence: float, meters
+    :param datasets: list of dataset names to resample (default: all)
+    :param fill_value: value of pixels not covered by the swath
+                       (default: _FillValue of the dataset, otherwise nan)
+    :return: satpy Scene
+    """
+    if cache is None or key is None:
+        kwargs = {} if fill_value is None else {'fill_value': fill_value}
+        return scn.resample(area_def, datasets=datasets,
+                            radius_of_influence=radius_of_influence, **kwargs)
+
+    new_scn = scn.copy(datasets=[])
+    tables = {}
+    for data_id in (datasets or scn.keys()):
+        data_arr = scn[data_id]
+        swath_def = data_arr.attrs['area']
+        if id(swath_def) not in tables:
+            tables[id(swath_def)] = cache.get_lookup_table(
+                key, swath_def, area_def, radius_of_influence)
+        new_scn[data_id] = xr.DataArray(
+            cache.gather(data_arr.values, *tables[id(swath_def)], area_def.shape,
+                         fill_value=data_arr.attrs.get('_FillValue', np.nan)
+                         if fill_value is None else fill_value),
+            dims=('y', 'x'),
+            attrs=dict(data_arr.attrs, area=area_def),
+        )
+    return new_scn
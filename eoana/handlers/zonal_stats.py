@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-10 09:47
+
+@author: johannes
+"""
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from eoana.config import Settings
+from eoana.handlers.grid_locator import GridLocator
+
+
+class ZonalStatistics:
+    """Statistics for every zone of a zone grid in one pass.
+
+    The zone grid (eg. water body or HELCOM basin ids) is prepared once:
+    pixels belonging to a zone are sorted by zone, so that count, mean and
+    std are bincount reductions and min, max and quantiles are segment
+    reductions over the valid (finite) values of each raster.
+
+    With a MaskedGrid (eoana.handlers.masked_grid) statistics are computed
+    on vectors of its valid pixels, zone pixels outside the masked grid are
+    left out.
+
+    Values that are not on the zone grid, eg. native swath pixels, are
+    assigned to the zone of the grid pixel they fall in (compute_points),
+    which skips the resampling.
+
+    Usage:
+        zonal = ZonalStatistics(Settings().get_basin_grid())
+        df = zonal.compute(chl_array, quantiles=(.1, .5, .9))
+
+        zonal = ZonalStatistics.from_raster(basin_grid_path)
+        df = zonal.compute_points(swath_chl, swath_lats, swath_lons)
+    """
+
+    def __init__(self, zone_grid, nodata=0, grid=None, locator=None):
+        """Prepare the zone grid.
+
+        :param zone_grid: 2-D array of zone ids
+        :param nodata: zone id of pixels outside any zone
+        :param grid: MaskedGrid of the same shape, compute takes its vectors
+        :param locator: GridLocator of the zone grid, used by compute_points
+        """
+        zones = np.asarray(zone_grid).ravel()
+        in_zone = zones != nodata
+        if np.issubdtype(zones.dtype, np.floating):
+            in_zone &= np.isfinite(zones)
+        if grid is not None:
+            in_zone &= grid.mask.ravel()
+        pixels = np.flatnonzero(in_zone)
+        self.shape = np.shape(zone_grid)
+        self.zone_ids, inverse = np.unique(zones[pixels], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        self._pixels = pixels[order]
+        if grid is not None:
+            self.shape = (grid.size,)
+            self._pixels = np.searchsorted(grid.index, self._pixels)
+        self._zones = inverse[order].astype(np.int32)
+        self._starts = np.searchsorted(self._zones, np.arange(self.n_zones))
+        self.locator = locator
+        # Zone index of the zone pixels in flat grid order, for lookups.
+        flat_order = np.argsort(pixels)
+        self._flat_pixels = pixels[flat_order]
+        self._flat_zones = inverse[flat_order].astype(np.int32)
+
+    @classmethod
+    def from_settings(cls, file_name=None, settings=None, **kwargs):
+        """Return instance for a grid in etc/basin_grid (default: basin grid)."""
+        settings = settings or Settings()
+        if file_name:
+            return cls(settings.get_zone_grid(file_name), **kwargs)
+        return cls(settings.get_basin_grid(), **kwargs)
+
+    @classmethod
+    def from_raster(cls, path, band=1, **kwargs):
+        """Return instance, with a GridLocator, for a zone raster file."""
+        with rio.open(path) as rst:
+            zone_grid = rst.read(band)
+        return cls(zone_grid, locator=GridLocator.from_raster(path), **kwargs)
+
+    @property
+    def n_zones(self):
+        return self.zone_ids.size
+
+    def _get_values(self, array):
+        """Return zone sorted values of the zone pixels."""
+        return np.asarray(array, dtype=np.float64).ravel()[self._pixels]
+
+    def compute(self, array, quantiles=None):
+        """Return statistics per zone.
+
+        :param array: 2-D array on the zone grid, missing values as nan
+                      (vector of the masked grid if given)
+        :param quantiles: list of floats in [0, 1], eg. (.1, .5, .9)
+        :return: pandas.DataFrame indexed by zone id with count, mean, std
+                 (population), min, max and optional quantile columns
+        """
+        return self._compute(self._get_values(array), self._zones,
+                             self._starts, quantiles=quantiles)
+
+    def get_zone_index(self, flat_index):
+        """Return zone index (position in zone_ids) of flat grid indices.
+
+        :param flat_index: int array, flat (raveled) grid index, -1 outside
+        :return: int array, -1 outside any zone
+        """
+        flat_index = np.asarray(flat_index)
+        if not self._flat_pixels.size:
+            return np.full(flat_index.shape, -1, dtype=np.int32)
+        position = np.searchsorted(self._flat_pixels, flat_index)
+        position = np.minimum(position, self._flat_pixels.size - 1)
+        found = (flat_index >= 0) & (self._flat_pixels[position] == flat_index)
+        return np.where(found, self._flat_zones[position], -1)
+
+    def compute_points(self, values, lat, lon, quantiles=None):
+        """Return statistics per zone of values at positions.
+
+        Every value counts once, in the zone of the grid pixel containing
+        its position. For native swath pixels (eg. chl_nn with lat / lon
+        from geo_coordinates) this gives basin statistics without
+        resampling, weighted by swath pixels rather than grid pixels.
+
+        :param values: array, missing values as nan
+        :param lat: array of latitudes (WGS84), shaped as values
+        :param lon: array of longitudes (WGS84), shaped as values
+        :param quantiles: list of floats in [0, 1]
+        :return: pandas.DataFrame, see compute
+        """
+        if self.locator is None:
+            raise ValueError('compute_points needs a locator, '
+                             'see ZonalStatistics.from_raster')
+        values = np.asarray(values, dtype=np.float64).ravel()
+        zones = self.get_zone_index(self.locator.get_flat_index(
+            np.ravel(lat), np.ravel(lon)))
+        inside = np.flatnonzero((zones >= 0) & np.isfinite(values))
+        order = np.argsort(zones[inside], kind='stable')
+        zones = zones[inside][order].astype(np.int32)
+        starts = np.searchsorted(zones, np.arange(self.n_zones))
+        return self._compute(values[inside][order], zones, starts,
+                             quantiles=quantiles)
+
+    def _compute(self, values, zones, starts, quantiles=None):
+        """Statistics of values grouped by (sorted) zone indices."""
+        n_zones = self.n_zones
+        valid = np.isfinite(values)
+        valid_zones = zones[valid]
+        valid_values = values[valid]
+
+        count = np.bincount(valid_zones, minlength=n_zones)
+        total = np.bincount(valid_zones, weights=valid_values, minlength=n_zones)
+        total_sq = np.bincount(valid_zones, weights=np.square(valid_values),
+                               minlength=n_zones)
+        has_values = count > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(has_values, total / count, np.nan)
+            var = np.where(has_values, total_sq / count - np.square(mean), np.nan)
+
+        stats = {
+            'count': count,
+            'mean': mean,
+            'std': np.sqrt(np.maximum(var, 0.)),
+        }
+        if values.size:
+            segments = starts < values.size
+            for key, func, fill in (('min', np.minimum, np.inf),
+                                    ('max', np.maximum, -np.inf)):
+                result = np.full(n_zones, np.nan)
+                reduced = func.reduceat(np.where(valid, values, fill),
+                                        starts[segments])
+                result[segments] = reduced
+                result[~has_values] = np.nan
+                stats[key] = result
+        else:
+            stats['min'] = stats['max'] = np.full(n_zones, np.nan)
+
+        if quantiles and not values.size:
+            for q in quantiles:
+                stats[f'q{q:g}'] = np.full(n_zones, np.nan)
+        elif quantiles:
+            # Valid values first, sorted within each zone.
+            order = np.lexsort((np.where(valid, values, np.inf), zones))
+            sorted_values = values[order]
+            for q in quantiles:
+                position = starts + q * np.maximum(count - 1, 0)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                lower = np.minimum(lower, values.size - 1)
+                upper = np.minimum(upper, values.size - 1)
+                fraction = position - lower
+                result = sorted_values[lower] * (1. - fraction) + \
+                    sorted_values[upper] * fraction
+                result[~has_values] = np.nan
+                stats[f'q{q:g}'] = result
+
+        df = pd.DataFrame(stats, index=pd.Index(self.zone_ids, name='zone'))
+        return df
@@ -0,0 +1,72 @@
+# Copyright (c) 2020 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-09 15:31
+
+@author: johannes
+
+"""
+import numpy as np
+import xarray as xr
+
+
+class DatacubeReader:
+    """
+    Reads time series and maps from a Zarr datacube written with
+    eoana.writers.datacube.DatacubeWriter. Only the chunks needed for a
+    query are read.
+    """
+    def __init__(self, store, variable='chl_nn'):
+        self.store = store
+        self.variable = variable
+        self.ds = xr.open_zarr(store)
+        if not self.ds.indexes['time'].is_monotonic_increasing:
+            # Stores appended out of order by older writers.
+            self.ds = self.ds.sortby('time')
+
+    @property
+    def data(self):
+        return self.ds[self.variable]
+
+    def get_map(self, time):
+        """
+        :param time: str / datetime
+        :return: 2-D array for the given date
+        """
+        return self.data.sel(time=time).values
+
+    def get_pixel_series(self, row, col, start=None, end=None):
+        """
+        :param row: int, grid row (eg. from GridLocator)
+        :param col: int, grid column
+        :param start: str / datetime
+        :param end: str / datetime
+        :return: pandas.Series indexed by time
+        """
+        series = self.data[:, row, col].sel(time=slice(start, end))
+        return series.to_series()
+
+    def get_zone_series(self, zone_mask, start=None, end=None):
+        """
+        Mean value within a zone (eg. basin_grid == 45) per date. Only the
+        bounding box of the zone is read.
+
+        :param zone_mask: 2-D boolean array on the grid of the datacube
+        :param start: str / datetime
+        :param end: str / datetime
+        :return: pandas.DataFrame with mean and count per date
+        """
+        rows = np.flatnonzero(zone_mask.any(axis=1))
+        cols = np.flatnonzero(zone_mask.any(axis=0))
+        if not rows.size:
+            raise ValueError('Empty zone mask')
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        subset = self.data[:, r0:r1, c0:c1].sel(time=slice(start, end)).values
+        values = np.where(zone_mask[r0:r1, c0:c1], subset, np.nan)
+        count = np.isfinite(values).sum(axis=(1, 2))
+        with np.errstate(invalid='ignore'):
+            mean = np.nansum(values, axis=(1, 2)) / count
+        df = self.data.time.sel(time=slice(start, end)).to_dataframe()
+        df['mean'] = mean
+        df['count'] = count
+        return df[['mean', 'count']]
@@ -4,45 +4,279 @@
 Created on 2021-03-24 09:13
 @author: johannes
 """
-import time
+import os
+import glob
 import numpy as np
+import pandas as pd
+import dask.array as da
+from dask.base import tokenize
 import rasterio as rio
-import matplotlib.pyplot as plt
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
 import xarray as xr
+from eoana.config import Settings
+from eoana.utils import RasterFileIndex, parse_raster_name
+
+
+def get_window(rst, window=None, bbox=None, area_name=None):
+    """
+    Return the pixel window of an open raster to read, None for the full
+    raster. The window is snapped to whole pixels and clipped to the raster.
+
+    :param rst: open rasterio dataset
+    :param window: rasterio Window or ((row_start, row_stop), (col_start, col_stop))
+    :param bbox: tuple, (left, bottom, right, top) in the reference system of the raster
+    :param area_name: str, area in etc/areas, eg. 'baws300_hanobay_sweref99tm'
+    :return: rasterio Window or None
+    """
+    if area_name:
+        area_def = Settings().get_area_definition(area_name)
+        bbox = transform_bounds(area_def.crs, rst.crs, *area_def.area_extent)
+    if bbox is not None:
+        window = from_bounds(*bbox, transform=rst.transform)
+    if window is None:
+        return None
+    if not isinstance(window, Window):
+        window = Window.from_slices(*window)
+    window = window.round_offsets().round_lengths()
+    return window.intersection(Window(0, 0, rst.width, rst.height))
+
+
+def get_legacy_nan_value(rst, band=1):
+    """
+    Return 0. for unpacked float bands without a numeric nodata, otherwise None.
+
+    Float rasters written before packing (see eoana.writers.geotiff.pack)
+    used 0 as fill value, whereas 0 is a valid (log10) value of packed rasters.
+
+    :param rst: open rasterio dataset
+    :param band: int
+    :return: float or None
+    """
+    unpacked = (rst.scales[band - 1], rst.offsets[band - 1]) == (1., 0.)
+    floating = np.issubdtype(np.dtype(rst.dtypes[band - 1]), np.floating)
+    if unpacked and floating and (rst.nodata is None or np.isnan(rst.nodata)):
+        return 0.
+    return None
+
+
+def read_band(rst, band=1, window=None, as_type=np.float32, nan_value=None,
+              masked=False, decode=True):
+    """
+    Read a band (window) of an open raster directly as as_type and set
+    missing values to nan in place (or mask them).
+
+    Packed bands (scale / offset other than 1 / 0, see
+    eoana.writers.geotiff.GeoTIFFWriter) are decoded: stored * scale + offset.
+
+    :param rst: open rasterio dataset
+    :param band: int
+    :param window: rasterio Window or None
+    :param as_type: dtype of the returned array
+    :param nan_value: stored value of missing pixels (default: nodata of the raster)
+    :param masked: bool, return numpy masked array instead of nan
+    :param decode: bool, apply scale / offset of packed bands
+    :return: 2-D array
+    """
+    if nan_value is None:
+        nan_value = rst.nodata
+    scale, offset = rst.scales[band - 1], rst.offsets[band - 1]
+    if decode and (scale, offset) != (1., 0.):
+        stored = rst.read(band, window=window)
+        missing = stored == nan_value if nan_value is not None else None
+        array = stored.astype(as_type)
+        array *= scale
+        array += offset
+    else:
+        array = rst.read(band, window=window, out_dtype=as_type)
+        missing = array == nan_value if nan_value is not None else None
+    if missing is None:
+        missing = np.zeros(array.shape, dtype=bool)
+    if masked:
+        return np.ma.MaskedArray(array, mask=missing, copy=False)
+    if np.issubdtype(array.dtype, np.floating):
+        array[missing] = np.nan
+    return array
 
 
 class GeoTIFFReader:
     """
+    Reads a band of a GeoTIFF, or only the blocks of a window of it.
+    Packed (scale / offset) bands are decoded, see read_band.
+
+    Usage:
+        array, meta = GeoTIFFReader.read_with_meta(
+            fid, area_name='baws300_hanobay_sweref99tm')
     """
     @staticmethod
-    def read(fid, as_type=None, nan_value=None):
-        as_type = as_type or float
-        nan_value = nan_value or 255.
-        rst = rio.open(fid)
-        array = rst.read()
-        array = array[0].astype(as_type)
-        array = np.where(array == nan_value, np.nan, array)
-        return array
+    def read(fid, as_type=None, nan_value=None, band=1, masked=False, **kwargs):
+        """
+        :param fid: str, path to raster
+        :param as_type: dtype of the returned array (default: float32)
+        :param nan_value: value replaced by nan / masked
+                          (default: nodata of the raster, otherwise 255)
+        :param band: int
+        :param masked: bool, return numpy masked array instead of nan
+        :param kwargs: window, bbox or area_name, see get_window
+        :return: 2-D array
+        """
+        with rio.open(fid) as rst:
+            return GeoTIFFReader._read(rst, as_type, nan_value, band, masked,
+                                       get_window(rst, **kwargs))
+
+    @staticmethod
+    def read_meta(fid, **kwargs):
+        """
+        :param fid: str, path to raster
+        :param kwargs: window, bbox or area_name, see get_window
+        :return: dict, meta of the (windowed) raster
+        """
+        with rio.open(fid) as rst:
+            return GeoTIFFReader._get_meta(rst, get_window(rst, **kwargs))
 
     @staticmethod
-    def read_meta(fid):
-        rst = rio.open(fid)
+    def read_with_meta(fid, as_type=None, nan_value=None, band=1, masked=False,
+                       **kwargs):
+        """
+        Data and meta from a single open, see read.
+
+        :return: tuple, (2-D array, dict)
+        """
+        with rio.open(fid) as rst:
+            window = get_window(rst, **kwargs)
+            array = GeoTIFFReader._read(rst, as_type, nan_value, band, masked,
+                                        window)
+            return array, GeoTIFFReader._get_meta(rst, window)
+
+    @staticmethod
+    def _read(rst, as_type, nan_value, band, masked, window):
+        """See read_band, nan_value defaults to 255 for rasters without nodata."""
+        if nan_value is None and rst.nodata is None:
+            nan_value = 255.
+        return read_band(rst, band=band, window=window,
+                         as_type=as_type or np.float32, nan_value=nan_value,
+                         masked=masked)
+
+    @staticmethod
+    def _get_meta(rst, window):
         meta = rst.meta.copy()
         meta.update(compress='lzw')
+        if window is not None:
+            meta.update(
+                width=window.width,
+                height=window.height,
+                transform=rst.window_transform(window),
+            )
         return meta
 
 
-def xarray_reader(fid):
-    xarr = xr.open_rasterio(fid)
-    # xarr.sizes['x']
-    # xarr.sizes['y']
-    # xarr.coords['x'].data
-    # xarr.coords['y'].data
-    # xarr.data
+class _LazyBand:
+    """
+    Array like access to a band of a raster file for dask. The file is
+    opened on access and only the requested window is read.
+    """
+    ndim = 2
+
+    def __init__(self, path, shape, dtype, band=1, nan_value=None):
+        self.path = path
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.band = band
+        self.nan_value = nan_value
+
+    def __getitem__(self, key):
+        window = Window.from_slices(*key, height=self.shape[0], width=self.shape[1])
+        with rio.open(self.path) as rst:
+            nan_value = self.nan_value
+            if nan_value is None:
+                nan_value = get_legacy_nan_value(rst, self.band)
+            return GeoTIFFReader._read(rst, self.dtype, nan_value,
+                                       self.band, False, window)
+
+
+def _get_raster_records(paths):
+    """Return sorted records (parse_raster_name + path) of rasters.
+
+    :param paths: directory, glob pattern or list of files
+    """
+    if isinstance(paths, str) and os.path.isdir(paths):
+        return RasterFileIndex(paths).records
+    if isinstance(paths, str):
+        paths = glob.glob(paths)
+    records = []
+    for path in paths:
+        attributes = parse_raster_name(os.path.basename(path))
+        if attributes:
+            attributes['path'] = os.path.abspath(path)
+            records.append(attributes)
+    return sorted(records, key=lambda r: (r['date'], r['time'] or '', r['path']))
+
+
+def xarray_reader(paths, variable='chl_nn', chunks=None, band=1, nan_value=None,
+                  as_type=np.float32, parameter=None):
+    """
+    Open eoana output rasters on a common grid as one lazy (dask) dataset
+    with a time dimension parsed from the file names, see
+    eoana.utils.parse_raster_name. Nothing is read until values are
+    computed, and then only the files and blocks that are needed.
+
+    Usage:
+        ds = xarray_reader(r'C:/Temp/Satellit/olci_output/helcom')
+        monthly = ds['chl_nn'].sel(time='2021').resample(time='1M').mean()
+
+    :param paths: directory, glob pattern or list of raster files
+    :param variable: str, name of the data variable
+    :param chunks: tuple, (rows, cols) of the dask chunks (default: one chunk per file)
+    :param band: int
+    :param nan_value: value replaced by nan (default: nodata of the rasters, 0 for
+                      unpacked float rasters without nodata, otherwise 255)
+    :param as_type: dtype of the data
+    :param parameter: str, only rasters of this parameter (eg. 'chl_nn'),
+                      '' for daily rasters without parameter in the name
+    :return: xarray.Dataset (time, y, x), passage as coordinate along time
+    """
+    records = _get_raster_records(paths)
+    if parameter is not None:
+        records = [r for r in records if (r['parameter'] or '') == parameter]
+    if not records:
+        raise FileNotFoundError('No eoana rasters found in %s' % paths)
+    with rio.open(records[0]['path']) as rst:
+        shape = rst.shape
+        transform = rst.transform
+        crs = rst.crs.to_wkt() if rst.crs else None
+
+    chunks = chunks or shape
+    # Dask keys depend on every read argument and the file modification
+    # time, so different reads of a file never share blocks.
+    bands = [
+        da.from_array(_LazyBand(r['path'], shape, as_type, band=band,
+                                nan_value=nan_value),
+                      chunks=chunks,
+                      name='raster-' + tokenize(
+                          r['path'], os.path.getmtime(r['path']), band,
+                          nan_value, np.dtype(as_type).str, chunks),
+                      meta=np.array((), dtype=as_type))
+        for r in records
+    ]
+    times = pd.to_datetime([
+        r['date'] + (r['time'] or '0000') for r in records
+    ], format='%Y%m%d%H%M')
+    x_coords = transform.c + transform.a * (np.arange(shape[1]) + .5)
+    y_coords = transform.f + transform.e * (np.arange(shape[0]) + .5)
+    return xr.Dataset(
+        {variable: (('time', 'y', 'x'), da.stack(bands))},
+        coords={
+            'time': times,
+            'y': y_coords,
+            'x': x_coords,
+            'passage': ('time', [r['passage'] or '' for r in records]),
+            'path': ('time', [r['path'] for r in records]),
+        },
+        attrs={'crs': crs},
+    )
 
 
 if __name__ == "__main__":
     fid = 'C:/Temp/Satellit/sentinel_data/kubdata/2021-02-26-.tif'
     gf_reader = GeoTIFFReader()
-    array = gf_reader.read(fid, as_type=float)
-    meta = gf_reader.read_meta(fid)
+    array, meta = gf_reader.read_with_meta(fid, as_type=float)
@@ -4,98 +4,47 @@ Created on 2022-04-27 14:14
 
 @author: johannes
 """
-import os
 import numpy as np
-import pandas as pd
-import rasterio as rio
-from itertools import chain
+from eoana.utils import RasterFileIndex
+from eoana.writers.geotiff import GeoTIFFWriter
+from eoana.handlers.masked_grid import MaskedGrid
+from eoana.handlers.composite import (
+    CompositeAccumulator, CompositeStore, get_parent_periods
+)
 
 
-def generate_filepaths(directory: str, pattern=''):
-    """Generate file paths."""
-    for path, _, fids in os.walk(directory):
-        for f in fids:
-            if pattern in f:
-                yield os.path.abspath(os.path.join(path, f))
-
-
-def get_array_from_raster(path):
-    rst = rio.open(path)
-    array = rst.read()
-    return array[0]
-
-
-def write_raster(path, data, meta):
-    with rio.open(path, 'w', **meta) as out:
-        out.write(data, 1)
-    out.close()
-
-
-def get_daily_mean(daily_files):
-    daily_passages = []
+def get_daily_accumulator(daily_files, grid=None):
+    accumulator = None
     for fid in daily_files:
-        data = get_array_from_raster(fid)
-        data = np.where(data == 0, np.nan, data)
-        daily_passages.append(data)
-
-    if not daily_passages:
-        return np.array(())
-    else:
-        return np.nanmean(daily_passages, axis=0)
-
-
-def get_sat_path(*args):
-    """Get path to sat-BAWS-data."""
-    files = ()
-    for p in args:
-        generator = generate_filepaths(
-            r'C:\Temp\Satellit\olci_output\helcom_daily_mean',
-            pattern=p
-        )
-        files = chain(files, generator)
-    return files
+        if accumulator is None:
+            accumulator = CompositeAccumulator.from_raster(fid, grid=grid)
+        accumulator.add_file(fid)
+    return accumulator
 
 
 if __name__ == '__main__':
-    rst2 = rio.open(r'C:\Utveckling\eoana\eoana\etc\basin_grid\raster_template_baws300_sweref99tm.tiff')
     out_path = r'C:\Temp\Satellit\olci_output\period_mean\{}.tiff'
-    meta = {m: rst2.meta[m] for m in ('driver', 'dtype', 'nodata', 'width', 'height', 'count', 'transform')}
-    meta['dtype'] = 'float32'
-    meta['count'] = 1
-    meta['compress'] = 'lzw'
+    writer = GeoTIFFWriter(area_name='baws300_sweref99tm')
 
-    periods = {
-        'spring': ('03', '04', '05'),
-        'summer': ('06', '07', '08'),
-        'autumn': ('09', '10', '11'),
-    }
-    for year in range(2017, 2022):
-        print(year)
-        if year != 2021:
+    # Partial sums per day, month, season and year, sea pixels only.
+    grid = MaskedGrid.from_settings('helcom_ospar.tiff')
+    store = CompositeStore(r'C:\Temp\Satellit\olci_output\composite_store')
+
+    raster_index = RasterFileIndex(r'C:\Temp\Satellit\olci_output\helcom')
+    touched_periods = set()
+    for date in raster_index.get_dates():
+        if store.has_day(date):
+            continue
+        accumulator = get_daily_accumulator(raster_index.get_date(date), grid=grid)
+        if accumulator is None:
             continue
-        for mon in ('06', '07', '08'):
-            print(mon)
-            if mon != '07':
-                continue
-            files = get_sat_path(f'{year}{mon}')
-            mean_array = get_daily_mean(files)
-            if not mean_array.size:
-                continue
-            write_raster(
-                out_path.format(f'{year}_{mon}'),
-                np.round(np.power(10, mean_array), 4),
-                # mean_array,
-                meta
-            )
-        # for period, months in periods.items():
-        #     print(period)
-        #     files = get_sat_path(*(f'{year}{p}' for p in months))
-        #     mean_array = get_daily_mean(files)
-        #     if not mean_array.size:
-        #         continue
-        #     write_raster(
-        #         out_path.format(f'{year}_{period}'),
-        #         # np.round(np.power(10, mean_array), 4),
-        #         mean_array,
-        #         meta
-        #     )
+        print(date)
+        store.add_day(date, accumulator)
+        touched_periods.update(get_parent_periods(date))
+
+    for period in sorted(touched_periods):
+        mean_array = grid.expand(store.get(period).mean())
+        writer.write(
+            np.round(np.power(10, mean_array), 4),
+            out_path.format(period),
+        )
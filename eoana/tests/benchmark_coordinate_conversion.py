@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-16 10:22
+
+@author: johannes
+"""
+import time
+import numpy as np
+import pandas as pd
+from eoana import utils
+
+
+def timed(func, *args, **kwargs):
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+if __name__ == '__main__':
+    n = 200000
+    rng = np.random.default_rng(0)
+    decmin = pd.Series(rng.uniform(5400, 6600, n).round(2)).map('%.2f'.__mod__)
+    decdeg = pd.Series(rng.uniform(54, 66, n).round(5))
+
+    scalar, scalar_time = timed(decmin.apply, utils.decmin_to_decdeg)
+    array, array_time = timed(utils.decmin_to_decdeg_array, decmin)
+    print(f'decmin_to_decdeg: apply {scalar_time:.2f} sec, '
+          f'array {array_time:.3f} sec, equal: {scalar.equals(array)}')
+
+    scalar, scalar_time = timed(decdeg.apply, utils.decdeg_to_decmin)
+    array, array_time = timed(utils.decdeg_to_decmin_array, decdeg)
+    print(f'decdeg_to_decmin: apply {scalar_time:.2f} sec, '
+          f'array {array_time:.3f} sec, equal: {scalar.equals(array)}')
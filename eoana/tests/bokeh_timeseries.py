@@ -27,9 +27,9 @@ from bokeh.models import (
 )
 from bokeh.models.tickers import MonthsTicker
 from bokeh.plotting import figure, show, output_file
-from pyproj import CRS, transform
 
 from eoana.handlers.bokeh_map import get_map
+from eoana.utils import to_web_mercator
 from sharkweb_data_handler import get_sharkdata
 
 output_file("chl_nn_water_body_validation_2016-2021.html")
@@ -37,11 +37,7 @@ output_file("chl_nn_water_body_validation_2016-2021.html")
 
 def convert_projection(lats, lons):
     """Convert coordinates to a different system."""
-    project_projection = CRS('EPSG:4326')
-    google_projection = CRS('EPSG:3857')
-    x, y = transform(project_projection, google_projection, lons, lats,
-                     always_xy=True)
-    return x, y
+    return to_web_mercator(lons, lats)
 
 
 def get_source(path, ts_column=None, lat_col=None, lon_col=None, data=None,
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 SMHI, Swedish Meteorological and Hydrological Institute.
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-23 10:14
+
+@author: johannes
+"""
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from eoana.writers.datacube import DatacubeWriter
+from eoana.readers.datacube import DatacubeReader
+
+
+if __name__ == '__main__':
+    """
+    Dates written out of order (backfilled / reprocessed days) and written
+    again must give a sorted time axis without duplicates.
+    """
+    area_name = 'baws300_hanobay_sweref99tm'
+    shape = (351, 400)
+    with tempfile.TemporaryDirectory() as directory:
+        store = os.path.join(directory, 'chl_nn.zarr')
+        writer = DatacubeWriter(store=store, area_name=area_name, chunks='map')
+        for date, value in (('2021-01-02', 2.), ('2021-01-04', 4.),
+                            ('2021-01-01', 1.), ('2021-01-03', 3.),
+                            ('2021-01-02', 2.)):
+            writer.write(np.full(shape, value, dtype=np.float32), date)
+
+        reader = DatacubeReader(store)
+        series = reader.get_pixel_series(10, 10, start='2021-01-01',
+                                         end='2021-01-03')
+        times = reader.data.indexes['time']
+        assert times.is_monotonic_increasing and times.is_unique, times
+        assert list(series.values) == [1., 2., 3.], series
+        assert series.index.equals(pd.date_range('2021-01-01', '2021-01-03'))
+        print('Datacube time axis sorted:', list(times.strftime('%Y-%m-%d')))
@@ -6,19 +6,12 @@ Created on 2021-09-27 17:59
 """
 import time
 import json
-import numpy as np
 import pandas as pd
-from eoana.utils import get_idx
+from eoana.handlers.grid_locator import GridLocator
 
 
 if __name__ == '__main__':
-    lat_array = np.load(r'latitude_baws300.npy')
-    lon_array = np.load(r'longitude_baws300.npy')
-    print('load complete')
-    # Testing.
-    # start_time = time.time()
-    # idx = get_idx(lat_array, lon_array, 59., 20.)
-    # print("Timeit:--%.5f sec" % (time.time() - start_time))
+    locator = GridLocator.from_area_name('baws300_sweref99tm')
 
     data = pd.read_csv(
         r'sharkweb_data_all_chl_2016-2021_incl_helcom_basins.txt',
@@ -29,19 +22,19 @@ if __name__ == '__main__':
         keep_default_na=False,
     )
 
-    positions = data[['LATIT_DD', 'LONGI_DD']].apply(
-        lambda x: '-'.join(x),
-        axis=1
-    )
-    unique_positions = positions.unique()
-
-    position_index = {}
-    for i, pos in enumerate(unique_positions):
-        if str(i).endswith('00'):
-            print(i)
-        lat, lon = pos.split('-')
-        idx = get_idx(lat_array, lon_array, float(lat), float(lon))
-        position_index.setdefault(pos, idx)
+    positions = data[['LATIT_DD', 'LONGI_DD']].drop_duplicates()
+
+    start_time = time.time()
+    rows, cols = locator.get_index(positions['LATIT_DD'].astype(float).values,
+                                   positions['LONGI_DD'].astype(float).values)
+    print("Timeit:--%.5f sec" % (time.time() - start_time))
+
+    position_index = {
+        '-'.join((lat, lon)): (int(r), int(c))
+        for lat, lon, r, c in zip(positions['LATIT_DD'], positions['LONGI_DD'],
+                                  rows, cols)
+        if r >= 0
+    }
 
     with open('position_index.json', "w") as outfile:
         json.dump(position_index, outfile, indent=4)
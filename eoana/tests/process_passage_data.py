@@ -9,100 +9,145 @@ Created on 2022-02-11 08:22
 import os
 import rasterio as rio
 from satpy import Scene
-from eoana.handlers.file_searcher import Seacher
+from eoana.handlers.file_searcher import (Seacher, get_passage_baseline,
+                                          get_passage_start_time)
+from eoana.handlers.passage_processor import PassageProcessor
+from eoana.handlers.regrid import GridAggregator
+from eoana.handlers.resample_cache import (ResampleCache, get_crop_slices,
+                                           get_resample_key, resample_scene)
+from eoana.writers.geotiff import GeoTIFFWriter
 from eoana.config import Settings
+from eoana.utils import get_coverage, get_mask
 import numpy as np
-from pyresample import load_area
 import time
-from functools import reduce
 import warnings
 warnings.filterwarnings('ignore')
 
 
-class BitFlags:
-    """Manipulate flags stored bitwise."""
-
-    def __init__(self, masks, meanings):
-        """Init the flags."""
-        self._masks = masks
-        self._meanings = meanings
-        self._map = dict(zip(meanings, masks))
-
-    def match_item(self, item, data):
-        """Match any of the item."""
-        mask = self._map[item]
-        return np.bitwise_and(data, mask).astype(np.bool)
-
-    def match_any(self, items, data):
-        """Match any of the items in data."""
-        mask = reduce(np.bitwise_or, [self._map[item] for item in items])
-        return np.bitwise_and(data, mask).astype(np.bool)
-
-    def __eq__(self, other):
-        """Check equality."""
-        return all(self._masks == other._masks) and self._meanings == other._meanings
-
-
 def get_zone_mask(path):
     rst = rio.open(path)
     array = rst.read()
     return array[0]
 
 
-FLAGS002 = [
-    "INVALID", "SNOW_ICE", "INLAND_WATER", "SUSPECT", "AC_FAIL",
-    "CLOUD", "HISOLZEN", "CLOUD_MARGIN", "CLOUD_AMBIGUOUS", "LOWRW", "LAND"
-]
-FLAGS003 = [
-    "INVALID", "SNOW_ICE", "INLAND_WATER", "SUSPECT", "AC_FAIL", "CLOUD",
-    "HISOLZEN", "CLOUD_MARGIN", "CLOUD_AMBIGUOUS", "COASTLINE", "LAND",
-    "TURBID_ATM", "LOWRW"
-]
-
-
-def get_flag_mask(scene):
-    bflags = BitFlags(scene['wqsf'].attrs['flag_masks'],
-                      scene['wqsf'].attrs['flag_meanings'].split())
+_RESOURCES = {}
+
+
+def get_resources(area_name, cache_dir):
+    """Return area, sea mask, resample cache, aggregator and writer (once per process)."""
+    if area_name not in _RESOURCES:
+        settings = Settings()
+        area_spec = settings.get_area_definition(area_name)
+        _RESOURCES[area_name] = {
+            'sea_mask': get_zone_mask(
+                os.path.join(settings.base_directory,
+                             'etc/basin_grid/helcom_ospar.tiff',
+                             # 'etc/basin_grid/HELCOM_subbasins_2018_incl_skagerrak.tiff',
+                             # 'etc/basin_grid/SVAR_2016_3b_coastal_zone.tiff'
+                             )
+            ) > 0,
+            'area_spec': area_spec,
+            'mask_buffer': np.empty(area_spec.shape, dtype=bool),
+            'resample_cache': ResampleCache(cache_dir),
+            'aggregator': GridAggregator(cache_dir),
+            'areas': {},
+            'writer': GeoTIFFWriter(area_name=area_name, packing='log10_chl'),
+        }
+    return _RESOURCES[area_name]
+
+
+def process_passage(job):
+    """Process one passage (PassageProcessor job).
+
+    The swath is cropped to the rows / columns covering the area (plus the
+    radius of influence), passages outside the area are skipped. Only wqsf
+    is loaded and resampled first. The fraction of valid water pixels
+    within the sea mask is stored as coverage in the manifest, and chl_nn
+    is only loaded, resampled and written when the coverage is at least
+    job['min_coverage'].
+
+    Other grids in job['derived_outputs'] ({area name: path}, eg.
+    baws1000_sweref99tm or baws_openstreetmap_merc) are aggregated from
+    the resampled grid (mean of the valid pixels) instead of resampling
+    the swath again. They are recorded as job['outputs'] in the manifest.
+    """
+    resources = get_resources(job['area_name'], job['cache_dir'])
+    radius_of_influence = 500
+    resample_kwargs = dict(
+        cache=resources['resample_cache'],
+        key=get_resample_key(job['inputs'], job['area_name']),
+        radius_of_influence=radius_of_influence,
+    )
 
-    return bflags.match_any(FLAGS003, scene['wqsf'])
-    # try:
-    #     return bflags.match_any(FLAGS003, scn['wqsf'])
-    # except:
-    #     return bflags.match_any(FLAGS002, scn['wqsf'])
+    scn = Scene(filenames={'olci_l2': job['inputs']})
+    scn.load(['wqsf'])
+    crop = get_crop_slices(scn['wqsf'].attrs['area'], resources['area_spec'],
+                           margin=radius_of_influence)
+    if crop is None:
+        return {'output': None, 'outputs': [], 'coverage': 0.}
+    # Pixels not covered by the swath get all flags set, ie. count as invalid.
+    flag_dtype = scn['wqsf'].dtype
+    flag_scn = resample_scene(
+        scn[crop], resources['area_spec'], datasets=['wqsf'],
+        fill_value=np.iinfo(flag_dtype).max
+        if np.issubdtype(flag_dtype, np.integer) else np.nan,
+        **resample_kwargs
+    )
+    mask = get_mask(flag_scn, out=resources['mask_buffer'],
+                    baseline=get_passage_baseline(job['inputs']))
+    coverage = get_coverage(mask, resources['sea_mask'])
+    if coverage < job.get('min_coverage', 0.):
+        return {'output': None, 'outputs': [], 'coverage': round(coverage, 4)}
+
+    scn.load(['chl_nn'])
+    scn = resample_scene(scn[crop], resources['area_spec'], datasets=['chl_nn'],
+                         **resample_kwargs)
+    mask |= ~resources['sea_mask']
+    chl = scn['chl_nn'].values
+    chl[mask] = np.nan
+    resources['writer'].write(chl, job['output'])
+
+    outputs = []
+    for area_name, path in job.get('derived_outputs', {}).items():
+        if area_name not in resources['areas']:
+            resources['areas'][area_name] = Settings().get_area_definition(area_name)
+        aggregated = resources['aggregator'].aggregate(
+            chl, resources['area_spec'], resources['areas'][area_name])
+        resources['writer'].write(aggregated['mean'], path, area_name=area_name)
+        outputs.append(path)
+    return {'output': job['output'], 'outputs': outputs,
+            'coverage': round(coverage, 4)}
 
 
 if __name__ == '__main__':
-    settings = Settings()
-
-    coastal_mask = get_zone_mask(
-        os.path.join(settings.base_directory,
-                     'etc/basin_grid/helcom_ospar.tiff',
-                     # 'etc/basin_grid/HELCOM_subbasins_2018_incl_skagerrak.tiff',
-                     # 'etc/basin_grid/SVAR_2016_3b_coastal_zone.tiff'
-                     )
-    )
-
-    area_spec = load_area(
-        os.path.join(settings.base_directory, 'etc/areas/areas_baws.yaml'),
-        'baws300_sweref99tm'
-    )
+    area_name = 'baws300_sweref99tm'
+    output_directory = r'C:\Temp\Satellit\olci_output\helcom'
+    cache_dir = r'C:\Temp\Satellit\resample_cache'
+    # Derived grids go to sibling directories of output_directory, a
+    # RasterFileIndex of output_directory then only holds baws300 rasters.
+    derived_directories = {
+        derived_area: os.path.join(os.path.dirname(output_directory), derived_area)
+        for derived_area in ('baws1000_sweref99tm', 'baws10000_sweref99tm',
+                             'baws_openstreetmap_merc')
+    }
+    for directory in derived_directories.values():
+        os.makedirs(directory, exist_ok=True)
 
     # sen3_data_l2 = '/data/proj/sentineldata/2020/OLCI'
     # sen3_data_l2 = r'E:\sentinel_3_data\olci_level_2'
     sen3_data_l2 = r'D:\olci_l2_003'
-    searcher = Seacher(base_dir=sen3_data_l2, satpy_reader='olci_l2')
-    # files_ready = os.listdir(r'C:\Temp\Satellit\olci_output\helcom')
-    # raise EOFError
-
+    searcher = Seacher(base_dir=sen3_data_l2, satpy_reader='olci_l2',
+                       catalog_path=os.path.join(sen3_data_l2, 'sen3_catalog.db'),
+                       area=Settings().get_area_definition(area_name))
+
+    processor = PassageProcessor(
+        process_passage,
+        os.path.join(output_directory, 'passage_manifest.json'),
+        max_workers=8,
+        max_retries=2,
+    )
     for date in searcher.passages.keys():
-        # if date.startswith('2021'):
-        #     if int(date[4:6]) > 4:
-        #         continue
-        #     elif (int(date[4:6]) == 4) and (int(date[6:8]) > 28):
-        #         continue
         for passage in searcher.passages[date].keys():
-            # if passage.startswith('S3A'):
-            #     continue
             filenames = searcher.get_passage_files(date, passage)
             size = 0
             for fid in filenames['olci_l2']:
@@ -111,28 +156,22 @@ if __name__ == '__main__':
                     size = _size
             if size > 100:  # Sometimes files are strangely large..
                 continue
-            print(date, passage)
-            start_time = time.time()
-            date_passage_passed = False
-            while not date_passage_passed:
-                scn = Scene(filenames=filenames)
-                scn.load(['chl_nn', 'wqsf'])
-
-                scn = scn.resample(area_spec, radius_of_influence=500)
-                mask = get_flag_mask(scn)
-                scn['chl_nn'] = scn['chl_nn'].where(coastal_mask > 0, np.nan)
-                scn['chl_nn'] = scn['chl_nn'].where(mask != True, np.nan)
-                name = '_'.join(
-                    (passage, scn.start_time.strftime('%Y%m%d_%H%M'), 'chl_nn'))
-                scn.save_dataset(
-                    'chl_nn',
-                    filename=fr'C:\Temp\Satellit\olci_output\helcom\{name}.tiff',
-                    dtype=np.float32,
-                    enhance=False
-                )
-                print("Timeit:--%.1f sec" % (time.time() - start_time))
-                date_passage_passed = True
-
-    # passes = []
-    # for d, item in searcher.passages.items():
-    #     passes.extend(item.keys())
+            start_time = get_passage_start_time(filenames['olci_l2'])
+            name = '_'.join(
+                (passage, start_time.strftime('%Y%m%d_%H%M'), 'chl_nn'))
+            processor.add_job(
+                f'{date}_{passage}',
+                inputs=filenames['olci_l2'],
+                output=os.path.join(output_directory, f'{name}.tiff'),
+                derived_outputs={
+                    derived_area: os.path.join(directory, f'{name}.tiff')
+                    for derived_area, directory in derived_directories.items()
+                },
+                area_name=area_name,
+                cache_dir=cache_dir,
+                min_coverage=0.01,
+            )
+
+    start_time = time.time()
+    print(processor.run())
+    print("Timeit:--%.1f sec" % (time.time() - start_time))
@@ -8,27 +8,29 @@ Created on 2022-02-13 17:57
 """
 import pandas as pd
 import geopandas as gp
-from shapely.geometry import Point
-from pyproj import CRS, transform
+from eoana.handlers.basin_tagger import BasinTagger
+from eoana.utils import to_web_mercator
 
 
 class HelcomBasin:
     """Doc."""
 
-    def __init__(self, shp_path=None):
+    def __init__(self, shp_path=None, zone_raster=None):
         self.shapes = gp.read_file(shp_path)
+        self.tagger = BasinTagger(
+            self.shapes.geometry.values,
+            self.shapes['level_3'].values,
+            # self.shapes['HELCOM_ID'].values,
+            zone_raster=zone_raster,
+        )
 
     def find_area_for_point(self, lat, lon):
-        """Return area information about the given location.
+        """Return area information about the given location."""
+        return self.tagger.tag(float(lat), float(lon))[0]
 
-        Includes polygon.
-        """
-        boolean = self.shapes.contains(Point(float(lon), float(lat)))
-        if any(boolean):
-            return self.shapes.loc[boolean, 'level_3'].values[0]
-            # return self.shapes.loc[boolean, 'HELCOM_ID'].values[0]
-        else:
-            return ''
+    def find_areas(self, lat, lon):
+        """Return area names for arrays of positions ('' outside all areas)."""
+        return self.tagger.tag(lat, lon)
 
     def get_polylines(self, boolean_basins):
         """Doc."""
@@ -42,11 +44,7 @@ class HelcomBasin:
 
 def convert_projection(lons, lats):
     """Convert coordinates to a different system."""
-    project_projection = CRS('EPSG:4326')
-    google_projection = CRS('EPSG:3857')
-    x, y = transform(project_projection, google_projection, lons, lats,
-                     always_xy=True)
-    return x, y
+    return to_web_mercator(lons, lats)
 
 
 def get_sharkdata(path):
@@ -77,14 +75,12 @@ def set_basin_info(path, shapes=None):
         dtype=str,
         keep_default_na=False,
     )
-    df['HELCOM_BASIN'] = ''
-    df['pos_combo'] = df[['LATIT_DD', 'LONGI_DD']].apply('-'.join, axis=1)
-    unique_pos = df['pos_combo'].unique()
-
-    for pos_str in unique_pos:
-        area_tag = shapes.find_area_for_point(*pos_str.split('-'))
-        boolean = df['pos_combo'] == pos_str
-        df.loc[boolean, 'HELCOM_BASIN'] = area_tag
+    positions = df[['LATIT_DD', 'LONGI_DD']].drop_duplicates()
+    positions['HELCOM_BASIN'] = shapes.find_areas(
+        positions['LATIT_DD'].astype(float),
+        positions['LONGI_DD'].astype(float),
+    )
+    df = df.merge(positions, on=['LATIT_DD', 'LONGI_DD'], how='left')
 
     cols = ['MYEAR', 'STATN', 'REP_STATN_NAME', 'SHIPC', 'VISITID',
             'SDATE', 'STIME', 'LATIT_DD', 'LONGI_DD',
@@ -34,10 +34,7 @@ scn.load(datasets)
 
 if __name__ == '__main__':
     settings = Settings()
-    bbox = settings.get_basin_grid_corners()
-    bottom, left = utils.transform_ref_system(lat=bbox.bottom, lon=bbox.left)
-    top, right = utils.transform_ref_system(lat=bbox.top, lon=bbox.right)
-    grid_poly = utils.get_polygon(llc=(left, bottom), urc=(right, top))
+    grid_poly = settings.get_basin_grid_polygon()
 
     # directory = 'C:/Temp/Satellit/sentinel_data'
 
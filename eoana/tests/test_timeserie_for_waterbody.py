@@ -13,23 +13,25 @@ import geopandas as gp
 import matplotlib.pyplot as plt
 from datetime import datetime
 from satpy import Scene, find_files_and_readers
-from pyresample import load_area
 from eoana.config import Settings
+from eoana.handlers.file_searcher import get_granule_polygon, get_passage_baseline
+from eoana.handlers.resample_cache import get_crop_slices
+from eoana.handlers.zonal_stats import ZonalStatistics
 from eoana import utils
 
 
 if __name__ == '__main__':
     settings = Settings()
-    basin_grid = settings.get_basin_grid()
-    bbox = settings.get_basin_grid_corners()
-    bottom, left = utils.transform_ref_system(lat=bbox.bottom, lon=bbox.left)
-    top, right = utils.transform_ref_system(lat=bbox.top, lon=bbox.right)
-    grid_poly = utils.get_polygon(llc=(left, bottom), urc=(right, top))
+    # Swath mode: statistics of the native swath pixels, no resampling.
+    swath_mode = True
+    if swath_mode:
+        zonal_stats = ZonalStatistics.from_raster(
+            os.path.join(settings.etc_path, 'basin_grid', 'SVAR_2016_3b_Hanö.tiff'))
+    else:
+        zonal_stats = ZonalStatistics(settings.get_basin_grid())
+    grid_poly = settings.get_basin_grid_polygon()
 
-    my_area = load_area(
-        os.path.join(settings.base_directory, 'etc/areas/local_areas.yaml'),
-        'baws300_hanobay_sweref99tm'
-    )
+    my_area = settings.get_area_definition('baws300_hanobay_sweref99tm')
 
     # months = set('5')
     months = set([str(n) for n in range(5, 10)])
@@ -40,37 +42,49 @@ if __name__ == '__main__':
     parameters = ('chl_nn.nc', 'wqsf.nc', 'tie_geometries.nc', 'geo_coordinates.nc')
     datasets = ['chl_nn', 'wqsf']
 
-    means = {key: [] for key in ('timestamp', 'mean_chl_nn')}
+    basin_stats = []
     for ts, data_folder in data_folders.items():
+        # Footprint check before any data is loaded.
+        scn_poly = get_granule_polygon(data_folder)
+        if scn_poly is not None and not grid_poly.intersects(scn_poly):
+            continue
+
         filenames = {'olci_l2': [os.path.join(data_folder, f) for f in parameters]}
 
         """ Create Scene object """
         scn = Scene(filenames=filenames)
         scn.load(datasets)
-        scn_poly = utils.get_polygon(coord_list=scn['chl_nn'].area.corners)
 
-        if grid_poly.intersects(scn_poly):
-            print('Using:', data_folder)
+        # Only the part of the swath covering the area is resampled.
+        crop = get_crop_slices(scn['chl_nn'].attrs['area'], my_area, margin=800)
+        if crop is None:
+            continue
+
+        print('Using:', data_folder)
+        scn = scn[crop]
+        if not swath_mode:
             scn = scn.resample(my_area, radius_of_influence=800)
 
-            mask = utils.get_mask(scn)
-            sea_area_data = scn['chl_nn'].where(
-                np.logical_and(basin_grid == 45, ~mask),
-                np.nan
-            )
+        mask = utils.get_mask(
+            scn, baseline=get_passage_baseline(filenames['olci_l2']))
+        chl_data = np.where(mask, np.nan, scn['chl_nn'].values)
 
-            mean_value = np.nanmean(sea_area_data)
-            if not np.isnan(mean_value):
-                means['timestamp'].append(ts)
-                means['mean_chl_nn'].append(mean_value)
-        # else:
-        #     print('NOT:', data_folder)
-            # print(scn_poly.exterior.coords.xy)
-            # if '20200501T092901_20200501T093201' in data_folder:
-            #     break
+        # Statistics for all basins at once.
+        if swath_mode:
+            lons, lats = scn['chl_nn'].attrs['area'].get_lonlats()
+            stats = zonal_stats.compute_points(chl_data, lats, lons)
+        else:
+            stats = zonal_stats.compute(chl_data)
+        stats = stats.loc[stats['count'] > 0].reset_index()
+        stats.insert(0, 'timestamp', ts)
+        basin_stats.append(stats)
 
-    df = pd.DataFrame(means)
-    df['mean_chl_nn'] = df['mean_chl_nn'].apply(lambda x: np.power(10, x))
-    df.to_csv('mean_chl_nn_2020.txt',
+    df = pd.concat(basin_stats, ignore_index=True)
+    df['mean_chl_nn'] = np.power(10, df['mean'])
+    df.loc[df['zone'] == 45, ['timestamp', 'mean_chl_nn']].to_csv(
+        'mean_chl_nn_2020.txt',
+        sep='\t',
+        index=False)
+    df.to_csv('zone_stats_chl_nn_2020.txt',
               sep='\t',
               index=False)
@@ -7,62 +7,239 @@ Created on 2020-12-11 15:57
 
 """
 import os
-import math
+import re
+import json
+from bisect import bisect_left, bisect_right
 import numpy as np
-from collections import Mapping
-from shapely.geometry import Polygon, Point
+from collections.abc import Mapping
+from shapely.geometry import Polygon
 from datetime import datetime
-from pyproj import CRS, transform
+import pandas as pd
+from pyproj import Transformer
 from decimal import Decimal, ROUND_HALF_UP
-from functools import reduce
+from functools import lru_cache
+
+
+# Flags masked out per OLCI processing baseline (wqsf), newest first.
+FLAG_SETS = {
+    '003': (
+        "INVALID", "SNOW_ICE", "INLAND_WATER", "SUSPECT", "AC_FAIL", "CLOUD",
+        "HISOLZEN", "CLOUD_MARGIN", "CLOUD_AMBIGUOUS", "COASTLINE", "LAND",
+        "TURBID_ATM", "LOWRW"
+    ),
+    '002': (
+        "INVALID", "SNOW_ICE", "INLAND_WATER", "SUSPECT", "AC_FAIL",
+        "CLOUD", "HISOLZEN", "CLOUD_MARGIN", "CLOUD_AMBIGUOUS", "LOWRW", "LAND"
+    ),
+}
 
 
 class BitFlags:
-    """Manipulate flags stored bitwise."""
+    """Manipulate flags stored bitwise.
+
+    Named flags are combined into one uint64 mask (compiled once per set of
+    items), masking is a single bitwise and per pixel on the native integer
+    data.
+
+    Usage:
+        bflags = BitFlags.from_attrs(scn['wqsf'].attrs)
+        mask = bflags.match_any(bflags.get_flag_set(baseline='003'),
+                                scn['wqsf'].values)
+    """
 
     def __init__(self, masks, meanings):
         """Init the flags."""
-        self._masks = masks
-        self._meanings = meanings
-        self._map = dict(zip(meanings, masks))
-
-    def match_item(self, item, data):
+        self._masks = np.asarray(masks, dtype=np.uint64)
+        self._meanings = list(meanings)
+        self._map = dict(zip(self._meanings, self._masks))
+        self._compiled = {}
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        """Return flags of a flag variable (eg. wqsf) given its attributes."""
+        return cls(attrs['flag_masks'], attrs['flag_meanings'].split())
+
+    def get_flag_set(self, baseline=None, flag_sets=None):
+        """Return items of the flag set (FLAG_SETS) of a processing baseline.
+
+        The set of the baseline, or of the newest older baseline (eg. '003'
+        for '004'), is used. Without a baseline the first set with all flags
+        defined in the flag meanings is used.
+
+        :param baseline: str, eg. '003' (see get_processing_baseline)
+        :param flag_sets: dict, {baseline: items} (default: FLAG_SETS)
+        :return: tuple of flag meanings
+        """
+        flag_sets = flag_sets or FLAG_SETS
+        if baseline:
+            known = [key for key in flag_sets if key <= baseline]
+            if not known:
+                raise KeyError('No flag set for processing baseline %s' % baseline)
+            items = flag_sets[max(known)]
+            undefined = [item for item in items if item not in self._map]
+            if undefined:
+                raise KeyError('Flags %s of baseline %s are not defined'
+                               % (undefined, baseline))
+            return items
+        for items in flag_sets.values():
+            if all(item in self._map for item in items):
+                return items
+        raise KeyError('No flag set matches the flag meanings: %s' % self._meanings)
+
+    def get_mask(self, items):
+        """Return combined uint64 mask of the items."""
+        items = (items,) if isinstance(items, str) else tuple(items)
+        if items not in self._compiled:
+            mask = np.uint64(0)
+            for item in items:
+                mask |= self._map[item]
+            self._compiled[items] = mask
+        return self._compiled[items]
+
+    def match_item(self, item, data, out=None):
         """Match any of the item."""
-        mask = self._map[item]
-        return np.bitwise_and(data, mask).astype(np.bool)
-
-    def match_any(self, items, data):
-        """Match any of the items in data."""
-        mask = reduce(np.bitwise_or, [self._map[item] for item in items])
-        return np.bitwise_and(data, mask).astype(np.bool)
+        return self.match_any((item,), data, out=out)
+
+    def match_any(self, items, data, out=None):
+        """Match any of the items in data.
+
+        :param items: flag meanings
+        :param data: integer array (missing values in float data count as match)
+        :param out: boolean array to write the result into
+        :return: boolean array
+        """
+        mask = self.get_mask(items)
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.floating):
+            missing = ~np.isfinite(data)
+            data = np.where(missing, 0, data).astype(np.uint64)
+            out = np.not_equal(np.bitwise_and(data, mask), 0, out=out)
+            return np.logical_or(out, missing, out=out)
+        if data.dtype != np.uint64:
+            data = data.astype(np.uint64)
+        return np.not_equal(np.bitwise_and(data, mask), 0, out=out)
+
+    def count(self, data, items=None):
+        """Return number of pixels per flag (bit counts), in one pass over data.
+
+        :param data: integer array
+        :param items: flag meanings (default: all flags)
+        :return: dict, {flag meaning: count}
+        """
+        values, counts = np.unique(np.asarray(data).astype(np.uint64, copy=False),
+                                   return_counts=True)
+        return {
+            item: int(counts[np.bitwise_and(values, self._map[item]) != 0].sum())
+            for item in (items or self._meanings)
+        }
 
     def __eq__(self, other):
         """Check equality."""
-        return all(self._masks == other._masks) and self._meanings == other._meanings
+        return np.array_equal(self._masks, other._masks) and \
+            self._meanings == other._meanings
 
 
-def get_mask(satpy_scn):
-    """Doc."""
-    bflags = BitFlags(satpy_scn['wqsf'].attrs['flag_masks'],
-                      satpy_scn['wqsf'].attrs['flag_meanings'].split())
+def get_processing_baseline(attrs):
+    """Return OLCI processing baseline (eg. '003') given by attributes.
 
-    return bflags.match_any(["INVALID", "SNOW_ICE", "INLAND_WATER", "SUSPECT",
-                             "AC_FAIL", "CLOUD", "HISOLZEN", "CLOUD_MARGIN",
-                             "CLOUD_AMBIGUOUS", "LOWRW", "LAND"],
-                            satpy_scn['wqsf'])
+    Looks for processing_baseline or a .SEN3 product_name (eg. from the
+    global attributes of the netcdf files).
 
+    :param attrs: dict
+    :return: str, None if not found
+    """
+    if attrs.get('processing_baseline'):
+        match = re.search(r'\d{3}', str(attrs['processing_baseline']))
+        if match:
+            return match.group()
+    if attrs.get('product_name'):
+        match = re.search(r'_(\d{3})\.SEN3', str(attrs['product_name']))
+        if match:
+            return match.group(1)
+    return None
+
+
+def get_mask(satpy_scn, flag_set=None, out=None, baseline=None):
+    """Return mask of flagged pixels (wqsf).
+
+    :param satpy_scn: satpy Scene with wqsf
+    :param flag_set: items to mask (default: FLAG_SETS entry of the
+                     processing baseline, see BitFlags.get_flag_set)
+    :param out: boolean array to write the result into
+    :param baseline: str, processing baseline, eg. '003' (default: from the
+                     wqsf attributes, see get_processing_baseline)
+    :return: boolean array
+    """
+    attrs = satpy_scn['wqsf'].attrs
+    bflags = BitFlags.from_attrs(attrs)
+    if flag_set is None:
+        flag_set = bflags.get_flag_set(
+            baseline=baseline or get_processing_baseline(attrs))
+    return bflags.match_any(flag_set, satpy_scn['wqsf'].values, out=out)
 
-def get_polygon(llc=None, urc=None, coord_list=None):
+
+def get_coverage(flagged, area_mask=None):
+    """Return fraction of valid (not flagged) pixels within the area.
+
+    :param flagged: boolean array, eg. from get_mask
+    :param area_mask: boolean array, pixels of the area (default: all pixels)
+    :return: float, 0 - 1 (0 for an empty area)
+    """
+    if area_mask is None:
+        total = flagged.size
+        valid = total - np.count_nonzero(flagged)
+    else:
+        total = np.count_nonzero(area_mask)
+        valid = total - np.count_nonzero(flagged & area_mask)
+    return valid / total if total else 0.
+
+
+def get_polygon(llc=None, urc=None, coord_list=None, in_proj=None):
+    """Return polygon of corner coordinates.
+
+    :param llc: tuple, (x, y) lower left corner
+    :param urc: tuple, (x, y) upper right corner
+    :param coord_list: list of corners with lon / lat in radians (eg. area.corners)
+    :param in_proj: str, reference system of llc / urc. If given, the corners
+                    are transformed to EPSG:4326 (lon, lat) in one call
+    :return: shapely.geometry.Polygon
+    """
     if coord_list:
-        pointlist = [Point(math.degrees(c.lon), math.degrees(c.lat)) for c in coord_list]
+        xs = np.degrees([c.lon for c in coord_list])
+        ys = np.degrees([c.lat for c in coord_list])
     else:
-        pointlist = [
-            Point(llc),
-            Point(urc[0], llc[1]),
-            Point(urc),
-            Point(llc[0], urc[1])
-        ]
-    return Polygon([[p.x, p.y] for p in pointlist])
+        xs = np.array([llc[0], urc[0], urc[0], llc[0]], dtype=float)
+        ys = np.array([llc[1], llc[1], urc[1], urc[1]], dtype=float)
+        if in_proj:
+            xs, ys = transform_xy(xs, ys, in_proj=in_proj, out_proj='EPSG:4326')
+    return Polygon(zip(xs, ys))
+
+
+def get_area_polygon(area_def, points_per_side=20, margin=0.):
+    """Return lon/lat polygon of the boundary of a pyresample AreaDefinition.
+
+    :param area_def: pyresample.geometry.AreaDefinition
+    :param points_per_side: int, number of boundary points along each side
+    :param margin: float, extend the area extent by margin (area units, eg. meters)
+    :return: shapely.geometry.Polygon
+    """
+    x_min, y_min, x_max, y_max = area_def.area_extent
+    x_min, y_min, x_max, y_max = x_min - margin, y_min - margin, x_max + margin, y_max + margin
+    steps = np.linspace(0., 1., points_per_side, endpoint=False)
+    xs = np.concatenate((
+        x_min + steps * (x_max - x_min),
+        np.full(points_per_side, x_max),
+        x_max - steps * (x_max - x_min),
+        np.full(points_per_side, x_min),
+    ))
+    ys = np.concatenate((
+        np.full(points_per_side, y_min),
+        y_min + steps * (y_max - y_min),
+        np.full(points_per_side, y_max),
+        y_max - steps * (y_max - y_min),
+    ))
+    lons, lats = get_transformer(area_def.crs, 'EPSG:4326').transform(xs, ys)
+    return Polygon(zip(lons, lats))
 
 
 def decmin_to_decdeg(pos, string_type=True, decimals=4):
@@ -106,6 +283,91 @@ def decdeg_to_decmin(pos: (str, float), string_type=True, decimals=2) -> (str, f
     return output
 
 
+def round_half_up(values, decimals=2):
+    """Return values rounded half up (away from zero), as round_value.
+
+    Same result as rounding the shortest repr of each float with
+    Decimal(..., ROUND_HALF_UP), without creating Decimal objects: the
+    candidate n = round(|x| * 10**decimals) is corrected by comparing |x|
+    with the correctly rounded floats of the half way points
+    (2n -/+ 1) / (2 * 10**decimals).
+
+    :param values: array like of floats
+    :param decimals: int
+    :return: float array
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10. ** decimals
+    absolute = np.abs(values)
+    n = np.round(absolute * scale)
+    n -= absolute < (2. * n - 1.) / (2. * scale)
+    n += absolute >= (2. * n + 1.) / (2. * scale)
+    return np.copysign(n / scale, values)
+
+
+def _to_float_array(pos):
+    """Return float array, empty strings (or other non numbers) as nan."""
+    if isinstance(pos, pd.Series):
+        return pd.to_numeric(pos, errors='coerce').to_numpy(dtype=np.float64)
+    return pd.to_numeric(np.asarray(pos).ravel(), errors='coerce').astype(
+        np.float64).reshape(np.shape(pos))
+
+
+def _format_array(values, fmt, pos):
+    """Return values formatted in bulk, '' for nan, shaped / indexed as pos."""
+    values = np.asarray(values)
+    output = np.empty(values.shape, dtype=object)
+    output.ravel()[:] = [fmt % value for value in values.ravel().tolist()]
+    output[np.isnan(values)] = ''
+    return _like_input(output, pos)
+
+
+def _like_input(values, pos):
+    if isinstance(pos, pd.Series):
+        return pd.Series(values, index=pos.index, name=pos.name)
+    return values
+
+
+def decmin_to_decdeg_array(pos, string_type=True, decimals=4):
+    """Array version of decmin_to_decdeg (same rounding).
+
+    :param pos: array or pandas.Series (str or float), DDMM.mm
+    :param string_type: As str? (empty str for missing positions)
+    :param decimals: Number of decimals
+    :return: array or pandas.Series (same index) of DD.dddd
+    """
+    values = _to_float_array(pos)
+    output = round_half_up(np.floor(values / 100.) + np.mod(values, 100.) / 60.,
+                           decimals=decimals)
+    if string_type:
+        return _format_array(output, '%%.%sf' % decimals, pos)
+    return _like_input(output, pos)
+
+
+def decdeg_to_decmin_array(pos, string_type=True, decimals=2):
+    """Array version of decdeg_to_decmin (same formatting).
+
+    :param pos: array or pandas.Series (str or float), DD.dddd
+    :param string_type: As str? (empty str for missing positions)
+    :param decimals: Number of decimals
+    :return: array or pandas.Series (same index) of DDMM.mm
+    """
+    values = _to_float_array(pos)
+    deg = np.floor(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        output = deg * 100.0 + np.mod(values, deg) * 60.0
+    if not string_type:
+        return _like_input(output, pos)
+    if decimals:
+        strings = _format_array(output, '%%2.%sf' % decimals, np.asarray(output))
+    else:
+        strings = _format_array(output, '%s', np.asarray(output))
+    three_digits = np.array([string.find('.') == 3 for string in strings.tolist()],
+                            dtype=bool)
+    strings[three_digits] = '0' + strings[three_digits]
+    return _like_input(strings, pos)
+
+
 def generate_filepaths(directory: str, pattern=''):
     """
     :param directory: str, directory path
@@ -118,6 +380,126 @@ def generate_filepaths(directory: str, pattern=''):
                 yield os.path.abspath(os.path.join(path, f))
 
 
+RASTER_NAME_PATTERN = re.compile(
+    r'^(?:(?P<satellite>S3[A-D])_(?P<orbit>\d{3})_)?(?P<date>\d{8})'
+    r'(?:_(?P<time>\d{4}))?(?:_(?P<parameter>.+?))?\.tiff?$'
+)
+
+
+def parse_raster_name(name):
+    """Return attributes given by the name of an eoana output raster.
+
+    Passage rasters: 'S3A_335_20211224_0930_chl_nn.tiff'
+    Daily rasters: '20211224.tiff'
+
+    :param name: str, file name
+    :return: dict (satellite, orbit, passage, date, time, parameter) or None
+    """
+    match = RASTER_NAME_PATTERN.match(name)
+    if not match:
+        return None
+    attributes = match.groupdict()
+    attributes['passage'] = '_'.join((attributes['satellite'], attributes['orbit'])) \
+        if attributes['satellite'] else None
+    return attributes
+
+
+def _get_date_string(date):
+    """Return date as 'YYYYMMDD' (accepts str or datetime like objects)."""
+    if isinstance(date, str):
+        return date.replace('-', '')[:8]
+    return date.strftime('%Y%m%d')
+
+
+class RasterFileIndex:
+    """In-memory index of eoana output rasters.
+
+    The directory tree is scanned once (os.scandir) and every raster is
+    indexed by date, time and passage parsed from its name, see
+    parse_raster_name. The index can be saved to and loaded from json.
+
+    Usage:
+        index = RasterFileIndex(r'C:/Temp/Satellit/olci_output/helcom')
+        files = index.get_date('20211224')
+    """
+
+    def __init__(self, directory=None, suffixes=('.tif', '.tiff')):
+        self.directory = directory
+        self.suffixes = suffixes
+        self.records = []
+        self._dates = []
+        if directory:
+            self.scan()
+
+    def scan(self):
+        """Scan the directory tree and (re)build the index."""
+        records = []
+        folders = [self.directory]
+        while folders:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folders.append(entry.path)
+                    elif entry.name.endswith(self.suffixes):
+                        attributes = parse_raster_name(entry.name)
+                        if attributes:
+                            attributes['path'] = os.path.abspath(entry.path)
+                            records.append(attributes)
+        self._set_records(records)
+
+    def _set_records(self, records):
+        self.records = sorted(records, key=lambda r: (r['date'], r['time'] or '',
+                                                      r['path']))
+        self._dates = [r['date'] for r in self.records]
+
+    def save(self, path):
+        """Save the index as json."""
+        with open(path, 'w') as fd:
+            json.dump({'directory': self.directory, 'records': self.records},
+                      fd, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        """Return index saved with save."""
+        with open(path, 'r') as fd:
+            data = json.load(fd)
+        index = cls()
+        index.directory = data['directory']
+        index._set_records(data['records'])
+        return index
+
+    def get_records(self, start=None, end=None, passage=None, parameter=None):
+        """Return records (dictionaries) within a date range.
+
+        :param start: str / datetime, first date (included)
+        :param end: str / datetime, last date (included)
+        :param passage: str, eg. 'S3A_335'
+        :param parameter: str, eg. 'chl_nn'
+        :return: list of dict
+        """
+        lo = bisect_left(self._dates, _get_date_string(start)) if start else 0
+        hi = bisect_right(self._dates, _get_date_string(end)) if end else len(self._dates)
+        return [r for r in self.records[lo:hi]
+                if (passage is None or r['passage'] == passage) and
+                (parameter is None or r['parameter'] == parameter)]
+
+    def get_date(self, date, **kwargs):
+        """Return paths of all rasters of a date."""
+        return [r['path'] for r in self.get_records(start=date, end=date, **kwargs)]
+
+    def get_period(self, start, end, **kwargs):
+        """Return paths of all rasters from start to end (both included)."""
+        return [r['path'] for r in self.get_records(start=start, end=end, **kwargs)]
+
+    def get_passage(self, passage, **kwargs):
+        """Return paths of all rasters of a passage, eg. 'S3A_335'."""
+        return [r['path'] for r in self.get_records(passage=passage, **kwargs)]
+
+    def get_dates(self):
+        """Return sorted unique dates ('YYYYMMDD')."""
+        return sorted(set(self._dates))
+
+
 def generate_folder_paths(directory: str, pattern=''):
     """Doc."""
     for path, subdir, fids in os.walk(directory):
@@ -136,7 +518,11 @@ def get_now_time(fmt=None) -> str:
 
 
 def get_idx(lat_array, lon_array, lat, lon):
-    """Return grid-index for closest position based on the given lat and lon."""
+    """Return grid-index for closest position based on the given lat and lon.
+
+    Brute force search over the full arrays, use
+    eoana.handlers.grid_locator.GridLocator when locating many positions.
+    """
     new_lat_mat = abs(lat_array - lat)
     new_lon_mat = abs(lon_array - lon)
     pos_in_mat = new_lat_mat + new_lon_mat
@@ -149,6 +535,17 @@ def get_idx(lat_array, lon_array, lat, lon):
     return i
 
 
+@lru_cache(maxsize=None)
+def get_transformer(in_proj, out_proj):
+    """Return a cached pyproj Transformer (always_xy) between two reference systems.
+
+    :param in_proj: str or pyproj.CRS, current reference system
+    :param out_proj: str or pyproj.CRS, reference system to transform to
+    :return: pyproj.Transformer
+    """
+    return Transformer.from_crs(in_proj, out_proj, always_xy=True)
+
+
 def recursive_dict_update(d: dict, u: dict) -> dict:
     """ Recursive dictionary update using
     Copied from:
@@ -169,6 +566,28 @@ def round_value(value: (str, int, float), nr_decimals=2) -> str:
     return str(Decimal(str(value)).quantize(Decimal('%%1.%sf' % nr_decimals % 1), rounding=ROUND_HALF_UP))
 
 
+def transform_xy(x, y, in_proj='EPSG:4326', out_proj='EPSG:3857'):
+    """Transform coordinates (x / lon first) between two reference systems.
+
+    All positions are transformed in one call with a cached transformer.
+
+    :param x: float, array or pandas.Series of x coordinates / longitudes
+    :param y: float, array or pandas.Series of y coordinates / latitudes
+    :param in_proj: str, current reference system
+    :param out_proj: str, reference system to transform to
+    :return: tuple, x and y as float (scalar input), array or pandas.Series
+             (indexed as the input)
+    """
+    index = x.index if isinstance(x, pd.Series) else None
+    out_x, out_y = get_transformer(in_proj, out_proj).transform(
+        np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    if index is not None:
+        return pd.Series(out_x, index=index), pd.Series(out_y, index=index)
+    if np.ndim(out_x) == 0:
+        return float(out_x), float(out_y)
+    return out_x, out_y
+
+
 def transform_ref_system(lat=None, lon=None, in_proj='EPSG:3006', out_proj='EPSG:4326'):
     """
     Transform coordinates from one spatial reference system to another.
@@ -176,13 +595,15 @@ def transform_ref_system(lat=None, lon=None, in_proj='EPSG:3006', out_proj='EPSG
     out_proj is the reference system you want to transform to, default is EPSG:4326 = WGS84
     (Another good is EPSG:4258 = ETRS89 (Europe), almost the same as WGS84 (in Europe)
     and not always clear if coordinates are in WGS84 or ETRS89, but differs <1m.
-    lat = latitude
-    lon = longitude
+    lat = latitude (or y), float, array or pandas.Series
+    lon = longitude (or x), float, array or pandas.Series
     To find your EPSG check this website: http://spatialreference.org/ref/epsg/
+    Returns y, x (lat, lon)
     """
-    o_proj = CRS(out_proj)
-    i_proj = CRS(in_proj)
+    x, y = transform_xy(lon, lat, in_proj=in_proj, out_proj=out_proj)
+    return y, x
 
-    x, y = transform(i_proj, o_proj, float(lon), float(lat), always_xy=True)
 
-    return y, x
+def to_web_mercator(lons, lats):
+    """Return x, y in EPSG:3857 (eg. bokeh maps) for WGS84 positions."""
+    return transform_xy(lons, lats, in_proj='EPSG:4326', out_proj='EPSG:3857')
@@ -0,0 +1,159 @@
+# Copyright (c) 2020 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-09 14:02
+
+@author: johannes
+
+"""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import xarray as xr
+from eoana.config import Settings
+from eoana.writers.writer import WriterBase
+
+# (time, y, x) chunk shapes.
+# series: fast time series extraction for pixels and basins.
+# map: fast reading of full maps for single dates.
+CHUNK_PRESETS = {
+    'series': (365, 64, 64),
+    'map': (1, 1024, 1024),
+}
+
+
+def get_area_coordinates(area_def):
+    """Return y and x projection coordinates (pixel centres) of an area."""
+    x_coords = np.asarray(area_def.projection_x_coords)
+    y_coords = np.asarray(area_def.projection_y_coords)
+    return y_coords, x_coords
+
+
+class DatacubeWriter(WriterBase):
+    """
+    Appends daily composites to a time x y x x Zarr store on an area grid
+    (etc/areas/areas_baws.yaml). Dates already in the store are overwritten
+    in place, so writing the same dates again does not duplicate them.
+
+    Dates older than the last date of the store are inserted in order (the
+    store is rewritten), the time axis is always sorted.
+
+    Appending single dates to a store with long time chunks ('series')
+    rewrites every spatial chunk per date. Append with 'map' chunks and
+    rechunk the finished store once instead.
+
+    Usage:
+        writer = DatacubeWriter(store=r'C:/Temp/chl_nn.zarr',
+                                area_name='baws300_sweref99tm',
+                                chunks='map')
+        writer.write(mean_array, '2021-07-15')
+        writer.rechunk(r'C:/Temp/chl_nn_series.zarr', chunks='series')
+    """
+    def __init__(self, *args, **kwargs):
+        super(DatacubeWriter, self).__init__()
+        self.store = None
+        self.area_name = 'baws300_sweref99tm'
+        self.variable = 'chl_nn'
+        self.chunks = 'map'
+        self.dtype = 'float32'
+        for key, item in kwargs.items():
+            setattr(self, key, item)
+        self._coordinates = None
+
+    @staticmethod
+    def _get_chunks(chunks):
+        if isinstance(chunks, str):
+            return CHUNK_PRESETS[chunks]
+        return tuple(chunks)
+
+    def _get_encoding(self, chunks):
+        return {
+            self.variable: {'chunks': self._get_chunks(chunks)},
+            'time': {'units': 'days since 1970-01-01', 'dtype': 'float64'},
+        }
+
+    def _get_coordinates(self):
+        if self._coordinates is None:
+            area_def = Settings().get_area_definition(self.area_name)
+            self._coordinates = get_area_coordinates(area_def) + (area_def.crs.to_wkt(),)
+        return self._coordinates
+
+    def write(self, data, times, store=None):
+        """
+        :param data: 2-D array (one date) or 3-D array (time, y, x)
+        :param times: date or list of dates (str / datetime)
+        :param store: str, path to the zarr store (default: self.store)
+        :return:
+        """
+        store = store or self.store
+        data = np.asarray(data, dtype=self.dtype)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        times = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(times)))
+        self._write(data, times, store)
+
+    def _write(self, data, times, store):
+        """
+        :param data: 3-D array (time, y, x)
+        :param times: pd.DatetimeIndex
+        :param store: str
+        :return:
+        """
+        y_coords, x_coords, crs_wkt = self._get_coordinates()
+        ds = xr.Dataset(
+            {self.variable: (('time', 'y', 'x'), data)},
+            coords={'time': times, 'y': y_coords, 'x': x_coords},
+            attrs={'area_name': self.area_name, 'crs': crs_wkt},
+        ).sortby('time')
+        if not os.path.exists(store):
+            ds.to_zarr(store, mode='w', encoding=self._get_encoding(self.chunks))
+            return
+
+        with xr.open_zarr(store) as existing:
+            stored_times = pd.DatetimeIndex(existing['time'].values)
+        positions = stored_times.get_indexer(ds['time'].values)
+        for i in np.flatnonzero(positions >= 0):
+            ds.isel(time=[i]).drop_vars(['time', 'y', 'x']).to_zarr(
+                store, region={'time': slice(positions[i], positions[i] + 1)})
+        new = ds.isel(time=np.flatnonzero(positions < 0))
+        if not new.sizes['time']:
+            return
+        if len(stored_times) and new['time'].values[0] < stored_times.max():
+            self._insert(new, store)
+        else:
+            new.to_zarr(store, append_dim='time')
+
+    def _insert(self, ds, store):
+        """Rewrite the store with dates older than its last date inserted.
+
+        Appending them would leave an unsorted time axis, which breaks time
+        slicing. The sorted store is written next to store and then
+        replaces it.
+        """
+        tmp_store = store.rstrip('/\\') + '.tmp'
+        with xr.open_zarr(store) as existing:
+            chunks = existing[self.variable].encoding['chunks']
+            merged = xr.concat([existing, ds], dim='time').sortby('time')
+            merged = merged.chunk(dict(zip(('time', 'y', 'x'), chunks)))
+            for name in merged.variables:
+                merged[name].encoding = {}
+            merged.to_zarr(tmp_store, mode='w',
+                           encoding=self._get_encoding(chunks))
+        shutil.rmtree(store)
+        os.replace(tmp_store, store)
+
+    def rechunk(self, target_store, chunks='series', store=None):
+        """Write a copy of the store with other chunks, eg. 'series'.
+
+        :param target_store: str, path to the new zarr store
+        :param chunks: str (CHUNK_PRESETS) or tuple (time, y, x)
+        :param store: str, path to the zarr store (default: self.store)
+        :return:
+        """
+        chunks = self._get_chunks(chunks)
+        with xr.open_zarr(store or self.store) as ds:
+            ds = ds.sortby('time').chunk(dict(zip(('time', 'y', 'x'), chunks)))
+            for name in ds.variables:
+                ds[name].encoding = {}
+            ds.to_zarr(target_store, mode='w', encoding=self._get_encoding(chunks))
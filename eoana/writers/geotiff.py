@@ -0,0 +1,190 @@
+# Copyright (c) 2020 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Created on 2022-11-17 09:12
+
+@author: johannes
+
+"""
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.shutil import copy as rio_copy
+from rasterio.transform import from_origin
+from eoana.config import Settings
+from eoana.writers.writer import WriterBase
+
+
+# Packed storage of float data as integers: stored = round((value - add_offset) / scale_factor).
+# log10_chl: log10 chlorophyll (chl_nn) in [-3.2767, 3.2767], ie. 0.00053 - 1891 mg/m3.
+# The absolute error in log10 is at most scale_factor / 2 = 5e-5, ie. at most
+# 0.012 % relative error in chlorophyll. Values outside the range are clipped.
+PACKING_PRESETS = {
+    'log10_chl': {'dtype': 'int16', 'scale_factor': 1e-4, 'add_offset': 0.,
+                  'nodata': -32768},
+}
+
+
+def get_default_nodata(dtype):
+    """Return nan for float types, otherwise the min (signed) or max (unsigned) value."""
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    info = np.iinfo(dtype)
+    return info.min if np.issubdtype(dtype, np.signedinteger) else info.max
+
+
+def pack(data, dtype, scale_factor, add_offset=0., nodata=None):
+    """Return data (float, nan as missing) packed as integers.
+
+    The max absolute error of the unpacked values (stored * scale_factor +
+    add_offset) is scale_factor / 2 within the range of dtype, nodata
+    excluded. Values outside the range are clipped.
+
+    :param data: array
+    :param dtype: str, integer type, eg. 'int16' or 'uint16'
+    :param scale_factor: float
+    :param add_offset: float
+    :param nodata: int, stored value of nan (default: get_default_nodata)
+    :return: array of dtype
+    """
+    dtype = np.dtype(dtype)
+    nodata = get_default_nodata(dtype) if nodata is None else nodata
+    info = np.iinfo(dtype)
+    low = info.min + 1 if nodata == info.min else info.min
+    high = info.max - 1 if nodata == info.max else info.max
+    packed = np.subtract(data, add_offset, dtype=np.float64)
+    packed /= scale_factor
+    np.rint(packed, out=packed)
+    missing = np.isnan(packed)
+    np.clip(packed, low, high, out=packed)
+    packed[missing] = nodata
+    return packed.astype(dtype)
+
+
+def get_area_meta(area_def):
+    """Return rasterio meta (crs, transform, width, height) of an AreaDefinition."""
+    x_min, _, _, y_max = area_def.area_extent
+    return {
+        'crs': area_def.crs.to_wkt(),
+        'transform': from_origin(x_min, y_max, area_def.pixel_size_x,
+                                 area_def.pixel_size_y),
+        'width': area_def.width,
+        'height': area_def.height,
+    }
+
+
+class GeoTIFFWriter(WriterBase):
+    """
+    Writes single band Cloud Optimized GeoTIFFs: tiled, compressed with
+    predictor and with internal overviews, compressed by several threads.
+    Windowed reads and zoomed out views only decode the tiles / overview
+    levels they need.
+
+    With a scale_factor (or a PACKING_PRESETS name as packing) float data
+    are stored as integers with scale / offset in the band metadata, and
+    decoded by eoana.readers.geotiff.GeoTIFFReader. See pack for the
+    precision.
+
+    Usage:
+        writer = GeoTIFFWriter(area_name='baws300_sweref99tm')
+        writer.write(array, 'S3A_335_20211224_0930_chl_nn.tiff')
+
+        writer = GeoTIFFWriter(area_name='baws300_sweref99tm', packing='log10_chl')
+
+        writer = GeoTIFFWriter(compress='ZSTD', blocksize=256)
+        writer.write(array, path, meta=GeoTIFFReader.read_meta(template))
+    """
+    def __init__(self, *args, **kwargs):
+        super(GeoTIFFWriter, self).__init__()
+        self.area_name = None
+        self.dtype = 'float32'
+        self.nodata = np.nan
+        self.compress = 'DEFLATE'   # DEFLATE / ZSTD / LZW
+        self.level = None           # compression level, None: GDAL default
+        self.predictor = 'YES'      # YES: floating point / horizontal predictor
+        self.blocksize = 512
+        self.overviews = 'AUTO'     # AUTO / NONE
+        self.overview_resampling = 'AVERAGE'
+        self.num_threads = 'ALL_CPUS'
+        self.packing = None         # name in PACKING_PRESETS
+        self.scale_factor = None
+        self.add_offset = 0.
+        for key, item in kwargs.items():
+            setattr(self, key, item)
+        if self.packing:
+            for key, item in PACKING_PRESETS[self.packing].items():
+                setattr(self, key, item)
+        self._area_meta = {}
+
+    def _get_area_meta(self, area_name):
+        if area_name not in self._area_meta:
+            area_def = Settings().get_area_definition(area_name)
+            self._area_meta[area_name] = get_area_meta(area_def)
+        return self._area_meta[area_name]
+
+    def get_creation_options(self):
+        """Return COG driver creation options."""
+        options = {
+            'COMPRESS': self.compress,
+            'PREDICTOR': self.predictor,
+            'BLOCKSIZE': self.blocksize,
+            'OVERVIEWS': self.overviews,
+            'OVERVIEW_RESAMPLING': self.overview_resampling,
+            'NUM_THREADS': self.num_threads,
+            'BIGTIFF': 'IF_SAFER',
+        }
+        if self.level is not None:
+            options['LEVEL'] = self.level
+        return options
+
+    def write(self, data, path, meta=None, area_name=None):
+        """
+        :param data: 2-D array
+        :param path: str, output file
+        :param meta: dict, rasterio meta with at least crs and transform
+        :param area_name: str, area in etc/areas (default: self.area_name),
+                          used when meta is not given
+        :return:
+        """
+        area_name = area_name or self.area_name
+        if meta is None:
+            if not area_name:
+                raise ValueError('Give meta or area_name')
+            meta = self._get_area_meta(area_name)
+        if self.scale_factor:
+            data = pack(data, self.dtype, self.scale_factor,
+                        add_offset=self.add_offset, nodata=self._get_nodata())
+        self._write(np.asarray(data, dtype=self.dtype), path, meta)
+
+    def _get_nodata(self):
+        if self.nodata is None or (
+                np.issubdtype(np.dtype(self.dtype), np.integer) and
+                np.isnan(self.nodata)):
+            return get_default_nodata(self.dtype)
+        return self.nodata
+
+    def _write(self, data, path, meta):
+        """
+        :param data: 2-D array of self.dtype
+        :param path: str
+        :param meta: dict
+        :return:
+        """
+        profile = {
+            'driver': 'GTiff',
+            'dtype': data.dtype.name,
+            'count': 1,
+            'width': data.shape[1],
+            'height': data.shape[0],
+            'crs': meta['crs'],
+            'transform': meta['transform'],
+            'nodata': self._get_nodata(),
+        }
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as rst:
+                rst.write(data, 1)
+                if self.scale_factor:
+                    rst.scales = (self.scale_factor,)
+                    rst.offsets = (self.add_offset,)
+                rio_copy(rst, path, driver='COG',
+                         **self.get_creation_options())